@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the API servers. Starts an Api with a few representative
+endpoints under each server, hammers it from concurrent clients and prints
+requests per second and latency percentiles.
+
+    ./api_bench.py [--clients 32] [--requests 4000] [--work_ms 2]
+
+Clients keep their connection open between requests where the server
+allows it (the asyncio server does, the threading server closes after
+every response), so the numbers include the cost of reconnecting.
+"""
+
+import api_server
+import argparse
+import http.client
+import socket
+import threading
+import time
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_api(work_ms):
+    api = api_server.Api(prefix="/")
+
+    def small(req):
+        req.send(200, body="ok")
+
+    def large(req):
+        req.send(200, body=b"x" * 65536, content_type="image/png")
+
+    def busy(req):
+        # stands in for a callback that blocks, like a screenshot or a settings change
+        time.sleep(work_ms / 1000.0)
+        req.send(200, body="done")
+
+    api.register_endpoint("/small", small)
+    api.register_endpoint("/large", large)
+    api.register_endpoint("/busy", busy)
+    return api
+
+
+def client(port, paths, count, latencies, errors):
+    conn = None
+    for n in range(count):
+        path = paths[n % len(paths)]
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            errors.append(path)
+            if conn:
+                conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - started)
+    if conn:
+        conn.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(server, clients, requests, work_ms):
+    port = free_port()
+    api = make_api(work_ms)
+    threading.Thread(target=api.run, args=("127.0.0.1", port), kwargs={"server": server}, daemon=True).start()
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    latencies = []
+    errors = []
+    paths = ["/small", "/small", "/large", "/busy"]
+    per_client = max(1, requests // clients)
+    threads = [
+        threading.Thread(target=client, args=(port, paths, per_client, latencies, errors))
+        for n in range(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(
+        "{:10} {:8.0f} req/s  p50 {:6.1f}ms  p99 {:6.1f}ms  max {:6.1f}ms  errors {}".format(
+            server,
+            len(latencies) / elapsed,
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            latencies[-1] * 1000,
+            len(errors),
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--work_ms", type=float, default=2.0, help="time the /busy endpoint blocks")
+    parser.add_argument("--servers", default="threading,asyncio")
+    args = parser.parse_args()
+
+    for server in args.servers.split(","):
+        bench(server, args.clients, args.requests, args.work_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 
+import asyncio
+import email.parser
 import getpass
+import http.client
 import http.server
 import json
+import mimetypes
+import os
+import traceback
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
+from email.utils import formatdate, parsedate_to_datetime
+from threading import Lock
 
 
 class ApiTest(unittest.TestCase):
+    class FakeRequest(object):
+        def __init__(self, path, command="GET"):
+            self.path = path
+            self.command = command
+            self.sent = None
+
+        def send(self, code, body=None, content_type="text/html", headers=None):
+            self.sent = (code, body, headers)
+
     def testRegister(self):
         api = Api()
 
@@ -18,6 +36,121 @@ class ApiTest(unittest.TestCase):
         self.assertTrue("/foo" in api.endpoints)
         self.assertTrue(api.endpoints["/foo"]["callback"] is foo_callback)
 
+    def testRoute(self):
+        api = Api(prefix="/")
+        api.register_endpoint("default", "default")
+        api.register_endpoint("/api", "api")
+        api.register_endpoint("/api/get", "get")
+        route = lambda path: (api.request_match(ApiTest.FakeRequest(path)) or {}).get("callback")
+        self.assertEqual(route("/api/get/foo"), "get")
+        self.assertEqual(route("/api/get?x=1"), "get")
+        self.assertEqual(route("/api/getfoo"), "api")
+        self.assertEqual(route("/api"), "api")
+        self.assertEqual(route("/other"), "default")
+
+    def testMethods(self):
+        api = Api(prefix="/")
+        api.register_endpoint("/get", lambda req: req.send(200), methods=["GET"])
+        api.register_endpoint("/set", lambda req: req.send(200), methods=["GET", "POST"])
+        req = ApiTest.FakeRequest("/get", "POST")
+        api.handle(req)
+        self.assertEqual(req.sent[0], 405)
+        self.assertEqual(req.sent[2], {"Allow": "GET"})
+        req = ApiTest.FakeRequest("/set", "POST")
+        api.handle(req)
+        self.assertEqual(req.sent[0], 200)
+        req = ApiTest.FakeRequest("/nothing")
+        api.handle(req)
+        self.assertEqual(req.sent[0], 404)
+        stats = api.route_stats()
+        self.assertEqual(stats["/set"]["hits"], 1)
+        self.assertEqual(stats["/get"]["rejected"], 1)
+        self.assertEqual(stats["not_found"], 1)
+
+    def testRange(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=900-", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=900-5000", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=0-1,5-6", 1000), None)
+        self.assertEqual(parse_range("lines=1-2", 1000), None)
+        self.assertRaises(ValueError, parse_range, "bytes=1000-", 1000)
+        self.assertRaises(ValueError, parse_range, "bytes=-0", 1000)
+
+
+def parse_range(header, size):
+    """
+    Return (first, last) byte positions for a Range header on a file of size
+    bytes, or None if the header should be ignored and the whole file sent
+    (not bytes, or several ranges). Raises ValueError if the range cannot be
+    satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # bytes=-n, the last n bytes
+            first, last = size - int(last), size - 1
+        else:
+            first, last = int(first), int(last) if last else size - 1
+    except ValueError:
+        return None
+    first = max(0, first)
+    if first >= size or last < first:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return first, min(last, size - 1)
+
+
+def send_file(req, path, content_type=None, headers=None):
+    """
+    Respond to req with the file at path, which must exist. Sends an ETag
+    and Last-Modified, answers If-None-Match and If-Modified-Since with 304,
+    and a single byte Range with 206. The body goes out with req.sendfile(),
+    straight from the file to the socket, without reading it into memory.
+    """
+    with open(path, "rb") as FILE:
+        stat = os.fstat(FILE.fileno())
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        headers = dict(headers or {})
+        headers.update({
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Accept-Ranges": "bytes",
+        })
+
+        if "If-None-Match" in req.headers:
+            if etag in [tag.strip() for tag in req.headers["If-None-Match"].split(",")]:
+                return req.send(304, headers=headers)
+        elif "If-Modified-Since" in req.headers:
+            try:
+                if int(stat.st_mtime) <= parsedate_to_datetime(req.headers["If-Modified-Since"]).timestamp():
+                    return req.send(304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+
+        code, first, last = 200, 0, size - 1
+        if "Range" in req.headers and req.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = parse_range(req.headers["Range"], size)
+            except ValueError as e:
+                headers["Content-Range"] = f"bytes */{size}"
+                return req.send(416, body=f"{e}\n", headers=headers)
+            if byte_range:
+                code, (first, last) = 206, byte_range
+                headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+
+        req.send_response(code)
+        req.send_header("Content-Type", content_type or mimetypes.guess_type(path)[0] or "application/octet-stream")
+        req.send_header("Content-Length", last - first + 1)
+        for keyword, value in headers.items():
+            req.send_header(keyword, value)
+        req.end_headers()
+        if size:
+            req.sendfile(FILE, first, last - first + 1)
+
 
 class Api(object):
     """
@@ -44,56 +177,97 @@ class Api(object):
     "responses", "rfile", "send", "send_error", "send_header", "send_response",
     "server", "server_version", "setup", "sys_version", "timeout", "version_string",
     "wbufsize", "weekdayname", and "wfile".
+
+    Started with Api.run(ip, port, server="asyncio"), your callback gets an
+    AsyncRequest instead, which has the commonly used subset of those.
     """
 
     def __init__(self, *args, **kwargs):
         self.prefix = "/api/v1"
         self.endpoints = {}
         self.special_paths = ["default"]
+        self.routes = self.new_route()
+        self.not_found = 0
+        self.stats_lock = Lock()
         for k, v in kwargs.items():
             setattr(self, k, v)
         self.prefix = self.prefix.rstrip("/")
 
+    def new_route(self):
+        return {"children": {}, "endpoint": None}
+
+    def segments(self, path):
+        return [segment for segment in path.split("?", 1)[0].split("/") if segment]
+
     def register_endpoint(self, path, callback, methods=["GET"]):
+        """
+        Endpoints are kept in a tree with one level per path segment, so a
+        request is routed by walking down it once.
+        """
         if not path or not callback:
             raise Exception("register_endpoint(path, callback)")
 
         if not path.startswith("/") and path not in self.special_paths:
             path = "/" + path
 
-        self.endpoints[path] = {
+        endpoint = {
             "path": path,
             "callback": callback,
             "methods": copy(methods),
+            "hits": 0,
+            "rejected": 0,
         }
+        self.endpoints[path] = endpoint
+
+        if path not in self.special_paths:
+            node = self.routes
+            for segment in self.segments(path):
+                node = node["children"].setdefault(segment, self.new_route())
+            node["endpoint"] = endpoint
 
     def request_match(self, req):
+        """
+        Return the endpoint registered for the longest run of leading path
+        segments of req.path, "default" if there is none, or None.
+        """
         if not req.path.startswith(self.prefix):
-            return req.send(
-                404,
-                body=f"Unrecognized path: {req.path}. Requests must start with {self.prefix}\n",
+            return None
+        node = self.routes
+        endpoint = node["endpoint"]
+        for segment in self.segments(req.path[len(self.prefix):]):
+            node = node["children"].get(segment)
+            if node is None:
+                break
+            if node["endpoint"]:
+                endpoint = node["endpoint"]
+        return endpoint or self.endpoints.get("default", None)
+
+    def route_stats(self):
+        """
+        Requests routed to each endpoint ("hits"), requests refused with 405
+        ("rejected"), and requests that matched nothing ("not_found").
+        """
+        with self.stats_lock:
+            stats = dict(
+                (path, {"methods": endpoint["methods"], "hits": endpoint["hits"], "rejected": endpoint["rejected"]})
+                for path, endpoint in self.endpoints.items()
             )
-        path = req.path.replace(self.prefix, "")
-        paths = list(self.endpoints.keys())
-        paths.sort(key=len)
-        paths.reverse()
-        for _p in paths:
-            if path.startswith(_p):
-                return self.endpoints[_p]
-        return self.endpoints.get("default", None)
+            stats["not_found"] = self.not_found
+        return stats
 
     class RequestHandler(http.server.BaseHTTPRequestHandler):
-        def send(self, code, body=None, content_type="text/html"):
+        def send(self, code, body=None, content_type="text/html", headers=None):
+            if body and isinstance(body, str):
+                body = body.encode("utf-8")
             self.send_response(code)
             if body:
                 self.send_header("Content-Type", content_type)
                 self.send_header("Content-Length", len(body))
+            for keyword, value in (headers or {}).items():
+                self.send_header(keyword, value)
             self.end_headers()
             if body:
-                if content_type.startswith("text"):
-                    self.wfile.write(body.encode("utf-8"))
-                else:
-                    self.wfile.write(body)
+                self.wfile.write(body)
 
         def reply(self, message):
             """
@@ -102,6 +276,10 @@ class Api(object):
             """
             self.send(200, body=message)
 
+        def sendfile(self, file, offset, count):
+            self.wfile.flush()
+            self.connection.sendfile(file, offset, count)
+
         def do_POST(self):
             if "Content-Length" in self.headers:
                 self.data = self.rfile.read(int(self.headers["Content-Length"]))
@@ -111,16 +289,48 @@ class Api(object):
             return self.do_ANY()
 
         def do_ANY(self):
-            self.parts = list(self.path.strip("/").split("/"))
-            endpoint = self.api.request_match(self)
-            if endpoint:
-                return endpoint["callback"](self)
-            else:
-                return self.send(
-                    404, body=f"Unrecognized request: {self.path}\n"
-                )
+            return self.api.handle(self)
+
+    def handle(self, req):
+        """
+        Find the endpoint for req and call it. Shared by both servers.
+        """
+        req.parts = list(req.path.strip("/").split("/"))
+        if not req.path.startswith(self.prefix):
+            with self.stats_lock:
+                self.not_found += 1
+            return req.send(
+                404,
+                body=f"Unrecognized path: {req.path}. Requests must start with {self.prefix}\n",
+            )
+        endpoint = self.request_match(req)
+        if not endpoint:
+            with self.stats_lock:
+                self.not_found += 1
+            return req.send(
+                404, body=f"Unrecognized request: {req.path}\n"
+            )
+        if req.command not in endpoint["methods"]:
+            with self.stats_lock:
+                endpoint["rejected"] += 1
+            return req.send(
+                405,
+                body=f"Method {req.command} not allowed for {req.path}\n",
+                headers={"Allow": ", ".join(endpoint["methods"])},
+            )
+        with self.stats_lock:
+            endpoint["hits"] += 1
+        return endpoint["callback"](req)
+
+    def run(self, ip, port, server="threading", **kwargs):
+        """
+        server is "threading", http.server's ThreadingHTTPServer with a thread
+        per connection, or "asyncio", an AsyncServer with keep-alive and a
+        bounded pool of threads for callbacks.
+        """
+        if server == "asyncio":
+            return AsyncServer(self, **kwargs).run(ip, port)
 
-    def run(self, ip, port):
         api = self
 
         class ApiRequestHandler(Api.RequestHandler):
@@ -132,5 +342,209 @@ class Api(object):
         http.server.ThreadingHTTPServer(("", port), ApiRequestHandler).serve_forever()
 
 
+class AsyncWriter(object):
+    """
+    req.wfile for the asyncio server. Writes are buffered and handed to the
+    event loop on flush(), which blocks the calling (handler) thread until
+    the data has been written, so a slow client holds back only its own
+    handler. Callbacks that stream should flush() after each chunk.
+    """
+
+    flush_bytes = 64 * 1024
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.flush_bytes:
+            self.flush()
+        return len(data)
+
+    async def drain(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if self.writer.is_closing():
+            raise BrokenPipeError("connection closed")
+        asyncio.run_coroutine_threadsafe(self.drain(data), self.loop).result()
+
+    def sendfile(self, file, offset, count):
+        """
+        Flush, then have the event loop send count bytes of file from
+        offset, with os.sendfile() where the transport allows it.
+        """
+        self.flush()
+        if self.writer.is_closing():
+            raise BrokenPipeError("connection closed")
+        asyncio.run_coroutine_threadsafe(
+            self.loop.sendfile(self.writer.transport, file, offset, count), self.loop
+        ).result()
+
+
+class AsyncRequest(object):
+    """
+    What callbacks get from the asyncio server. It has the parts of
+    BaseHTTPRequestHandler that callbacks use: command, path, headers,
+    request_version, client_address, data (the request body), parts,
+    wfile, close_connection, send_response(), send_header(), end_headers(),
+    send(), reply() and sendfile().
+    """
+
+    server_version = "Hawks/1.0"
+
+    def __init__(self, api, command, path, request_version, headers, data, client_address, wfile):
+        self.api = api
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+        self.data = data
+        self.client_address = client_address
+        self.wfile = wfile
+        self.parts = []
+        self.responded = False
+        self.headers_buffer = []
+
+        connection = headers.get("Connection", "").lower()
+        if request_version == "HTTP/1.1":
+            self.close_connection = connection == "close"
+        else:
+            self.close_connection = connection != "keep-alive"
+
+    def send_response(self, code, message=None):
+        self.responded = True
+        if message is None:
+            message = http.server.BaseHTTPRequestHandler.responses.get(code, ("",))[0]
+        self.headers_buffer.append(f"HTTP/1.1 {code} {message}\r\n")
+        self.send_header("Server", self.server_version)
+        self.send_header("Date", formatdate(usegmt=True))
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "connection" and str(value).lower() == "close":
+            self.close_connection = True
+        self.headers_buffer.append(f"{keyword}: {value}\r\n")
+
+    def end_headers(self):
+        if self.close_connection:
+            self.headers_buffer.append("Connection: close\r\n")
+        self.headers_buffer.append("\r\n")
+        self.wfile.write("".join(self.headers_buffer).encode("latin-1"))
+        self.headers_buffer = []
+
+    def send(self, code, body=None, content_type="text/html", headers=None):
+        if body and isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(code)
+        if body:
+            self.send_header("Content-Type", content_type)
+        # always sent, the connection is kept open for the next request
+        self.send_header("Content-Length", len(body) if body else 0)
+        for keyword, value in (headers or {}).items():
+            self.send_header(keyword, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def reply(self, message):
+        self.send(200, body=message)
+
+    def sendfile(self, file, offset, count):
+        self.wfile.sendfile(file, offset, count)
+
+
+class AsyncServer(object):
+    """
+    An asyncio HTTP/1.1 server for an Api. Connections are kept open between
+    requests (up to keepalive_sec idle) and cost no thread while idle.
+    Callbacks are ordinary blocking functions, so each request is handed to
+    a pool of at most workers threads; a burst of requests queues for the
+    pool instead of starting a thread apiece.
+    """
+
+    def __init__(self, api, workers=8, keepalive_sec=15, max_header_bytes=65536):
+        self.api = api
+        self.workers = workers
+        self.keepalive_sec = keepalive_sec
+        self.max_header_bytes = max_header_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self.loop = None
+
+    def dispatch(self, req):
+        """
+        Runs in the handler pool.
+        """
+        try:
+            self.api.handle(req)
+        except Exception as e:
+            if not isinstance(e, ConnectionError):
+                traceback.print_exc()
+            req.close_connection = True
+            if not req.responded:
+                try:
+                    req.send(500, body=f"Internal error: {e}\n")
+                except ConnectionError:
+                    return
+        try:
+            req.wfile.flush()
+        except ConnectionError:
+            req.close_connection = True
+
+    async def read_request(self, reader):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=self.keepalive_sec)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            return None
+        request_line, _, header_bytes = head.partition(b"\r\n")
+        words = request_line.decode("latin-1").split()
+        if len(words) != 3:
+            return None
+        headers = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(header_bytes)
+        data = b""
+        length = headers.get("Content-Length")
+        if length:
+            data = await reader.readexactly(int(length))
+        return words, headers, data
+
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info("peername")
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                (command, path, request_version), headers, data = request
+                req = AsyncRequest(
+                    self.api, command, path, request_version, headers, data, client_address, AsyncWriter(self.loop, writer)
+                )
+                await self.loop.run_in_executor(self.executor, self.dispatch, req)
+                if req.close_connection:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, ip, port):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_connection, ip, port, limit=self.max_header_bytes)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, ip, port):
+        print("Calling AsyncServer on ({}, {}) running as {}".format("", port, getpass.getuser()))
+        asyncio.run(self.serve("", port))
+
+
 if __name__ == "__main__":
     unittest.main()
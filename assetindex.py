@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+"""
+Index of the image files under a directory, shared by the slideshow and the
+webui so that neither has to list the directory itself.
+
+The index is built with one recursive scan and then kept current by a
+watchdog observer. Without watchdog it falls back to rescanning when it is
+older than rescan_sec. Paths are relative to the indexed directory and are
+kept sorted, so callers can use them as-is or shuffle a copy in O(n).
+
+Image metadata (width, height, frame count) is read from file headers by a
+background thread, or on demand by metadata(), and is re-read whenever a
+file's mtime changes.
+"""
+
+import os
+import time
+from bisect import bisect_left
+from base import Base
+from PIL import Image, UnidentifiedImageError
+from random import shuffle
+from threading import Event, RLock, Thread
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class AssetEventHandler(FileSystemEventHandler):
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        self.index.update(event.src_path)
+        if getattr(event, "dest_path", None):
+            self.index.update(event.dest_path)
+
+
+class AssetIndex(Base):
+    def __init__(self, directory, rescan_sec=30):
+        super().__init__()
+        self.directory = os.path.abspath(directory)
+        self.rescan_sec = rescan_sec
+        self.entries = {}
+        # every relpath, kept sorted as files come and go; copied before a
+        # change if paths() has handed it out
+        self.sorted_all = []
+        self.sorted_all_shared = False
+        self.top_level = None
+        self.version = 0
+        self.scanned = 0
+        self.lock = RLock()
+        self.listeners = []
+        self.observer = None
+        self.metadata_wanted = Event()
+        self.scan()
+        self.watch()
+        Thread(target=self.fill_metadata, daemon=True).start()
+
+    def relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.directory)
+
+    def walk(self, top):
+        """
+        Yield (relpath, mtime, size) for every file under top. Uses an explicit
+        stack rather than recursion, so deep trees are fine.
+        """
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        try:
+                            if entry.is_dir():
+                                stack.append(entry.path)
+                            elif entry.is_file():
+                                st = entry.stat()
+                                yield (self.relpath(entry.path), st.st_mtime, st.st_size)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def scan(self):
+        entries = {}
+        touched = []
+        with self.lock:
+            old = self.entries
+        for relpath, mtime, size in self.walk(self.directory):
+            entry = old.get(relpath)
+            if not entry or entry["mtime"] != mtime or entry["size"] != size:
+                entry = {"mtime": mtime, "size": size}
+                touched.append(relpath)
+            entries[relpath] = entry
+        touched.extend(r for r in old if r not in entries)
+        with self.lock:
+            self.entries = entries
+            self.scanned = time.time()
+            if touched:
+                self.changed(touched)
+        self.metadata_wanted.set()
+
+    def watch(self):
+        if Observer is None or not os.path.isdir(self.directory):
+            return
+        try:
+            self.observer = Observer()
+            self.observer.daemon = True
+            self.observer.schedule(AssetEventHandler(self), self.directory, recursive=True)
+            self.observer.start()
+        except Exception as e:
+            print(f"Unable to watch {self.directory}, rescanning every {self.rescan_sec}s: {e}")
+            self.observer = None
+
+    def refresh(self):
+        if self.observer is None and time.time() - self.scanned > self.rescan_sec:
+            self.scan()
+
+    def changed(self, relpaths):
+        """
+        Called with self.lock held whenever files are added, removed or modified.
+        Listeners are called with the index and the list of relpaths that changed.
+        """
+        self.version += 1
+        self.update_sorted(relpaths)
+        self.top_level = None
+        for callback in self.listeners:
+            try:
+                callback(self, relpaths)
+            except Exception as e:
+                print(f"Asset index listener failed: {e}")
+
+    def update_sorted(self, relpaths):
+        """
+        Bring sorted_all up to date with entries for the relpaths that
+        changed, in O(n) rather than sorting everything again. Called with
+        self.lock held.
+        """
+        if len(relpaths) > 64 or not self.sorted_all:
+            # a scan, or a whole directory at once: sorting is cheaper
+            self.sorted_all = sorted(self.entries)
+            self.sorted_all_shared = False
+            return
+        if self.sorted_all_shared:
+            self.sorted_all = list(self.sorted_all)
+            self.sorted_all_shared = False
+        paths = self.sorted_all
+        for relpath in relpaths:
+            i = bisect_left(paths, relpath)
+            listed = i < len(paths) and paths[i] == relpath
+            if relpath in self.entries and not listed:
+                paths.insert(i, relpath)
+            elif relpath not in self.entries and listed:
+                del paths[i]
+
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+    def update(self, path):
+        """
+        Bring the index up to date for one path that a watchdog event touched.
+        """
+        relpath = self.relpath(path)
+        if relpath.startswith("..") or any(part.startswith(".") for part in relpath.split(os.sep)):
+            return
+        if os.path.isdir(path):
+            found = {r: (m, s) for r, m, s in self.walk(path)}
+            with self.lock:
+                touched = []
+                for r, (mtime, size) in found.items():
+                    entry = self.entries.get(r)
+                    if not entry or entry["mtime"] != mtime or entry["size"] != size:
+                        self.entries[r] = {"mtime": mtime, "size": size}
+                        touched.append(r)
+                if touched:
+                    self.changed(touched)
+            self.metadata_wanted.set()
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        with self.lock:
+            if st is None:
+                prefix = relpath + os.sep
+                gone = [r for r in self.entries if r == relpath or r.startswith(prefix)]
+                for r in gone:
+                    del self.entries[r]
+                if gone:
+                    self.changed(gone)
+                return
+            entry = self.entries.get(relpath)
+            if entry and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+                return
+            self.entries[relpath] = {"mtime": st.st_mtime, "size": st.st_size}
+            self.changed([relpath])
+        self.metadata_wanted.set()
+
+    def paths(self, recursive=True):
+        """
+        Sorted relative paths of every file in the index.
+        """
+        self.refresh()
+        with self.lock:
+            if recursive:
+                self.sorted_all_shared = True
+                return self.sorted_all
+            if self.top_level is None:
+                self.top_level = [r for r in self.sorted_all if os.sep not in r]
+            return self.top_level
+
+    def shuffled(self, recursive=True):
+        paths = list(self.paths(recursive=recursive))
+        shuffle(paths)
+        return paths
+
+    def read_metadata(self, relpath):
+        try:
+            with Image.open(os.path.join(self.directory, relpath)) as image:
+                return {
+                    "width": image.width,
+                    "height": image.height,
+                    "n_frames": getattr(image, "n_frames", 1),
+                }
+        except (OSError, UnidentifiedImageError):
+            return {"width": 0, "height": 0, "n_frames": 0}
+
+    def metadata(self, relpath):
+        """
+        Return a dict of width, height, n_frames, mtime and size for relpath,
+        or None if it is not in the index. n_frames is 0 for files that PIL
+        cannot open.
+        """
+        with self.lock:
+            entry = self.entries.get(relpath)
+            if entry is None:
+                return None
+            if "n_frames" in entry:
+                return dict(entry)
+        # read the file without the lock, it may be slow
+        metadata = self.read_metadata(relpath)
+        with self.lock:
+            entry.update(metadata)
+            return dict(entry)
+
+    def fill_metadata(self):
+        """
+        Background thread: read headers for entries that do not have them yet.
+        """
+        while True:
+            self.metadata_wanted.wait()
+            self.metadata_wanted.clear()
+            with self.lock:
+                missing = [r for r, entry in self.entries.items() if "n_frames" not in entry]
+            for relpath in missing:
+                self.metadata(relpath)
+
+
+indexes = {}
+indexes_lock = RLock()
+
+
+def get_index(directory):
+    """
+    AssetIndex objects are shared per directory, so there is only ever one
+    scan and one observer for each.
+    """
+    directory = os.path.abspath(directory)
+    with indexes_lock:
+        index = indexes.get(directory)
+        if index is None:
+            index = indexes[directory] = AssetIndex(directory)
+        return index
@@ -32,7 +32,7 @@ except:
 import math
 import sys
 from PIL import Image
-from sample import sample, generate_offsets
+from sample import get_sampler
 
 class DotstarPixel(object):
     def __init__(self, radius, position, total_pixels):
@@ -52,6 +52,10 @@ class Disc(object):
         radius          distance from the origin of the circle
         position        ordinal position along the circle
         total_pixels    number of pixels in this circle
+
+    The x, y position of every pixel in an image of a given size is
+    computed once per size by coordinate_map() and shared by all Disc
+    objects, so sampling, the mock and disc animations never redo the trig.
     """
 
     # dotstar disc numbers, radius of and count of pixels in each circle
@@ -68,21 +72,32 @@ class Disc(object):
         (0.0, 1),
     ]
 
+    # (width, height) -> ((x, y) per pixel, y * width + x per pixel)
+    coordinate_maps = {}
+
     def __init__(self, *args, **kwargs):
         self.pixels = []
         self.max_radius = None
+        self.last_pixels = None
+        self.init_pixels()
         if mock:
-            self.dots = adafruit_dotstar.DotStar(board.SCK, board.MOSI, 255, auto_write=False, disc=self)
+            self.dots = adafruit_dotstar.DotStar(
+                board.SCK, board.MOSI, 255, auto_write=False, disc=self, mock_fps=kwargs.get("mock_fps", 30)
+            )
         else:
             self.dots = adafruit_dotstar.DotStar(board.SCK, board.MOSI, 255, auto_write=False)
 
     def set_image(self, image):
         """
         Write pixels to the DotStar disc. image should contain
-        a list of 255 RGBA pixel values. If it doesn't then
+        a list of 255 RGB pixel values. If it doesn't then
         render a quare/rectangular image for a DotStar disc.
         sample_image() maps the disc's circular coordinates to
         locations in the image and samples it.
+
+        The pixels are written to the DotStar buffer with one slice
+        assignment, and nothing is sent to the disc at all if they
+        are the same as the last frame.
         """
 
         #if len(image) != 255:
@@ -90,14 +105,19 @@ class Disc(object):
             pixels = self.sample_image(image)
         else:
             pixels = image
-        for idx, pixel in enumerate(pixels):
-            self.dots[idx] = pixel[0:3]
+        if pixels and len(pixels[0]) != 3:
+            # DotStar takes a 4th element as brightness, drop anything extra
+            pixels = [tuple(pixel[0:3]) for pixel in pixels]
+        if pixels == self.last_pixels:
+            return
+        self.dots[0:len(pixels)] = pixels
         self.dots.show()
+        self.last_pixels = pixels
 
     def blank(self):
-        for idx, tup in enumerate(self.dots):
-            self.dots[idx] = (0, 0, 0)
+        self.dots.fill((0, 0, 0))
         self.dots.show()
+        self.last_pixels = [(0, 0, 0)] * len(self.pixels)
 
     def get_pixels(self, xy_range):
         """
@@ -105,8 +125,39 @@ class Disc(object):
         xy_range is a tuple of (x,y) sizes (result will start at 0)
         circles is a list of (radius, pixel_count) tuples.
         """
-        self.init_pixels()
-        return (self.calculate_xy(px, xy_range) for px in self.pixels)
+        return iter(self.coordinate_map(xy_range))
+
+    def compile_map(self, xy_range):
+        xy_range = tuple(xy_range)
+        maps = Disc.coordinate_maps.get(xy_range)
+        if maps is None:
+            coords = tuple(self.calculate_xy(px, xy_range) for px in self.pixels)
+            flat = tuple(y * xy_range[0] + x for (x, y) in coords)
+            maps = Disc.coordinate_maps[xy_range] = (coords, flat)
+        return maps
+
+    def coordinate_map(self, xy_range):
+        """
+        Tuple of the (x, y) position of each pixel, in pixel order, for an
+        image of size xy_range.
+        """
+        return self.compile_map(xy_range)[0]
+
+    def index_map(self, xy_range):
+        """
+        Tuple of the offset (y * width + x) of each pixel into the flat pixel
+        data of an image of size xy_range.
+        """
+        return self.compile_map(xy_range)[1]
+
+    def pixels_image(self, pixels, size=(64, 64)):
+        """
+        Draw a list of disc pixels as an image, each at its place on the disc.
+        """
+        data = bytearray(size[0] * size[1] * 3)
+        for pixel, offset in zip(pixels, self.index_map(size)):
+            data[offset * 3 : offset * 3 + 3] = bytes(int(c) for c in pixel[0:3])
+        return Image.frombytes("RGB", size, bytes(data))
 
     def init_pixels(self):
         self.pixels = []
@@ -140,10 +191,9 @@ class Disc(object):
 
         return (x, y)
 
-    def sample_image(self, image, radius=1):
-        pixels = self.get_pixels(image.size)
-        offsets = generate_offsets("circle", radius)
-        return sample(image, pixels, offsets)
+    def sample_image(self, image, radius=1, kernel="circle"):
+        sampler = get_sampler(image.size, self.coordinate_map(image.size), kernel=kernel, radius=radius)
+        return sampler(image)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+Support for driving several displays from one Hawks.
+
+The devices setting lists the displays after the first one, separated by
+semicolons. Each is a comma separated list of setting overrides applied on
+top of the main settings for that display only; a bare name means True:
+
+    --devices "disc; mock,rows=64,cols=64"
+
+One ImageController renders frames once into a FanoutQueue, which hands the
+same frame objects to a queue per display. Each display has its own
+MatrixController, which does its own shaping (panel reshape, disc sampling,
+letterboxing to its own rows and cols if they differ from the main
+display's) on its own timer thread. All of them are started from one shared start
+time and advance by the same frame durations, so they stay in step.
+"""
+
+from queue import Queue
+
+
+def parse_value(value):
+    lowered = value.lower()
+    if lowered == "true":
+        return True
+    if lowered == "false":
+        return False
+    return value
+
+
+def parse_devices(spec):
+    """
+    Return a list of dicts of setting overrides, one per device in spec.
+    """
+    devices = []
+    for device in (spec or "").split(";"):
+        overrides = {}
+        for item in device.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if "=" in item:
+                name, value = item.split("=", 1)
+                overrides[name.strip()] = parse_value(value.strip())
+            else:
+                overrides[item] = True
+        if overrides:
+            devices.append(overrides)
+    return devices
+
+
+def apply_overrides(values, overrides):
+    """
+    Apply overrides to a dict of setting values, converting strings to the
+    type of the setting they replace.
+    """
+    values = dict(values)
+    for name, value in overrides.items():
+        existing = values.get(name)
+        if isinstance(value, str) and type(existing) in (int, float):
+            try:
+                value = type(existing)(value)
+            except ValueError:
+                pass
+        values[name] = value
+    return values
+
+
+class FanoutQueue(object):
+    """
+    Looks like a Queue to an ImageController, and puts every frame on each
+    of queues. qsize() is that of the fullest queue, so a display that falls
+    behind holds the renderer back rather than letting frames pile up.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def put(self, item, *args, **kwargs):
+        for queue in self.queues:
+            queue.put(item, *args, **kwargs)
+
+    def qsize(self):
+        return max(queue.qsize() for queue in self.queues)
+
+    def empty(self):
+        return all(queue.empty() for queue in self.queues)
+
+    def get(self, *args, **kwargs):
+        """
+        Take the next frame off every queue that has one and return it,
+        used to drain the queues.
+        """
+        item = None
+        for queue in self.queues:
+            if not queue.empty():
+                got = queue.get(*args, **kwargs)
+                if item is None:
+                    item = got
+        return item
+
+    @classmethod
+    def create(cls, count):
+        queues = [Queue() for n in range(count)]
+        return cls(queues), queues
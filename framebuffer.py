@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""
+A display backend that writes frames into a memory-mapped file, for local
+viewers, screenshot tools and tests that want the live output without a
+terminal or hardware.
+
+File layout, all little-endian:
+
+    offset  size  field
+    0       4     magic, b"HWKF"
+    4       2     layout version, 1
+    6       2     header size, HEADER_SIZE
+    8       4     width
+    12      4     height
+    16      8     sequence number, incremented for every frame
+    24      8     timestamp of the frame, seconds since the epoch (double)
+    32      4     index of the buffer holding the current frame, 0 or 1
+    36      28    reserved
+    64            two buffers of width * height * 3 bytes of raw RGB
+
+The writer only ever draws into the buffer that is not current, then
+publishes it by updating the header, sequence number last. Readers take
+the sequence number, read the current buffer, and check that the sequence
+number has not moved; if it has, the writer lapped them and they read
+again. FramebufferReader does this.
+"""
+
+import mmap
+import os
+import struct
+import time
+from PIL import Image
+
+MAGIC = b"HWKF"
+VERSION = 1
+HEADER_SIZE = 64
+HEADER = struct.Struct("<4sHHII")
+FRAME = struct.Struct("<dI")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 16
+FRAME_OFFSET = 24
+
+
+class FramebufferCanvas(object):
+    """
+    One of the two buffers in the file. Like rgbmatrix's FrameCanvas, it is
+    drawn into offscreen and put on display by SwapOnVSync().
+    """
+
+    def __init__(self, matrix, index):
+        self.matrix = matrix
+        self.index = index
+        self.width = matrix.width
+        self.height = matrix.height
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != (self.width, self.height):
+            canvas = Image.new("RGB", (self.width, self.height), "black")
+            canvas.paste(image, (offset_x, offset_y))
+            image = canvas
+        start = self.matrix.buffer_offset(self.index)
+        self.matrix.map[start : start + self.matrix.frame_bytes] = image.tobytes()
+
+    def Clear(self):
+        start = self.matrix.buffer_offset(self.index)
+        self.matrix.map[start : start + self.matrix.frame_bytes] = bytes(self.matrix.frame_bytes)
+
+
+class FramebufferMatrix(object):
+    """
+    Implements the parts of rgbmatrix.RGBMatrix that MatrixController uses,
+    writing to the file at path instead of to panels.
+    """
+
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = options
+        self.width = options.cols * getattr(options, "chain_length", 1)
+        self.height = options.rows
+        self.frame_bytes = self.width * self.height * 3
+        size = HEADER_SIZE + 2 * self.frame_bytes
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.map[0:HEADER_SIZE] = bytes(HEADER_SIZE)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, HEADER_SIZE, self.width, self.height)
+        self.seq = 0
+        self.front = 0
+        self.canvases = [FramebufferCanvas(self, 0), FramebufferCanvas(self, 1)]
+
+    def buffer_offset(self, index):
+        return HEADER_SIZE + index * self.frame_bytes
+
+    def CreateFrameCanvas(self):
+        return self.canvases[1 - self.front]
+
+    def SwapOnVSync(self, canvas, framerate_fraction=1):
+        """
+        Publish canvas as the current frame and hand back the other buffer.
+        """
+        self.front = canvas.index
+        FRAME.pack_into(self.map, FRAME_OFFSET, time.time(), self.front)
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+        return self.canvases[1 - self.front]
+
+    def SetImage(self, image, *args, **kwargs):
+        canvas = self.CreateFrameCanvas()
+        canvas.SetImage(image)
+        self.SwapOnVSync(canvas)
+
+    def Clear(self):
+        canvas = self.CreateFrameCanvas()
+        canvas.Clear()
+        self.SwapOnVSync(canvas)
+
+
+class FramebufferReader(object):
+    """
+    Reads frames written by a FramebufferMatrix, possibly in another process.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as FB:
+            self.map = mmap.mmap(FB.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size, self.width, self.height = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a hawks framebuffer")
+        self.header_size = header_size
+        self.frame_bytes = self.width * self.height * 3
+
+    def seq(self):
+        return SEQ.unpack_from(self.map, SEQ_OFFSET)[0]
+
+    def read(self):
+        """
+        Return (seq, timestamp, image) for the current frame. The image is
+        a copy, safe to keep after the writer moves on.
+        """
+        while True:
+            seq = self.seq()
+            timestamp, front = FRAME.unpack_from(self.map, FRAME_OFFSET)
+            start = self.header_size + front * self.frame_bytes
+            data = self.map[start : start + self.frame_bytes]
+            if self.seq() == seq:
+                return seq, timestamp, Image.frombytes("RGB", (self.width, self.height), data)
+
+    def view(self):
+        """
+        Return (seq, timestamp, image) with image backed directly by the
+        mapped file, no copy. It is only valid until the writer publishes
+        one more frame, because the writer starts drawing the next frame
+        into this buffer straight after; compare seq with self.seq() after
+        using it, and use read() for a frame to keep.
+        """
+        seq = self.seq()
+        timestamp, front = FRAME.unpack_from(self.map, FRAME_OFFSET)
+        start = self.header_size + front * self.frame_bytes
+        view = memoryview(self.map)[start : start + self.frame_bytes]
+        return seq, timestamp, Image.frombuffer("RGB", (self.width, self.height), view, "raw", "RGB", 0, 1)
+
+    def wait(self, seq, timeout=None, interval=0.005):
+        """
+        Wait until a frame newer than seq has been published. Returns the
+        new sequence number, or None on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            current = self.seq()
+            if current != seq:
+                return current
+            if deadline is not None and time.time() > deadline:
+                return None
+            time.sleep(interval)
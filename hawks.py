@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
+import fanout
 import os
+import prerender
+import preview
 import time
 from base import Base
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import copy
 from settings import Settings
 from matrixcontroller import MatrixController
 from imagecontroller import ImageController
 from queue import Queue
-from threading import Thread
+from threading import Lock, RLock, Thread, Timer
 
 
 class HawksSettings(Settings):
@@ -40,6 +45,16 @@ class HawksSettings(Settings):
             categories=["matrix"],
             tags=["advanced"],
         )
+        self.set("panel_cols", 0, helptext="Width of one panel in a decomposed chain, 0 for the full image width", categories=["matrix"], tags=["advanced"])
+        self.set(
+            "panel_layout",
+            "stack",
+            helptext="Order a decomposed chain runs through its panels: stack, serpentine (rows), or u (columns)",
+            choices=["stack", "serpentine", "u"],
+            categories=["matrix"],
+            tags=["advanced"],
+        )
+        self.set("panel_rotate", 0, helptext="Rotation of a decomposed chain in degrees", choices=[0, 90, 180, 270], categories=["matrix"], tags=["advanced"])
         self.set(
             "row_address_type",
             0,
@@ -68,8 +83,12 @@ class HawksSettings(Settings):
         self.set("back_and_forth", False, helptext="Loop GIF back and forth", choices=[False, True], categories=["file", "slideshow"])
         self.set("gif_repeat_whole_times", False, helptext="Play GIFS a whole number of times in slideshows", choices=[False, True], categories=["slideshow"])
         self.set("url", "", helptext="Fetch image from url", categories=["url"])
-        self.set("urls", "", choices=[], categories=["url"], read_only=True)
+        self.set("urls", "", choices=[], categories=["url", "playlist"], read_only=True)
         self.set("urls_file", "", helptext="File containing image urls, one url per line", categories=["url"], tags=["advanced"])
+        self.set("url_cache_dir", ".hawks_cache", helptext="Directory for cached url images", categories=["url"], tags=["advanced"])
+        self.set("url_cache_mb", 32, helptext="Maximum size of the url image cache in MB", categories=["url"], tags=["advanced"])
+        self.set("url_cache_fresh_sec", 60, helptext="Seconds to use a cached url image before revalidating it", categories=["url"], tags=["advanced"])
+        self.set("url_timeout_sec", 5.0, helptext="Timeout for fetching url images, stale cached images are shown on timeout", categories=["url"], tags=["advanced"])
         self.set("config_file", ".hawks.json", helptext="Hawks config file for image urls and saved configs (JSON)", tags=["advanced"])
         self.set(
             "disc",
@@ -79,6 +98,16 @@ class HawksSettings(Settings):
             categories=["matrix"],
             tags=["advanced"],
         )
+        self.set(
+            "disc_sample",
+            "circle",
+            helptext="How the disc averages the image around each pixel",
+            choices=["circle", "box", "gaussian"],
+            categories=["matrix"],
+            tags=["advanced"],
+        )
+        self.set("disc_sample_radius", 1, helptext="Radius in image pixels averaged for each disc pixel", categories=["matrix"], tags=["advanced"])
+        self.set("shape_cache_mb", 16, helptext="Memory in MB for frames already shaped for the display", categories=["matrix"], tags=["advanced"])
         self.set(
             "transpose",
             "none",
@@ -98,16 +127,27 @@ class HawksSettings(Settings):
         self.set(
             "mock", False, helptext="Display is mock rgbmatrix", choices=[False, True], categories=["matrix"], tags=["advanced"]
         )
+        self.set("framebuffer", "", helptext="Write frames to this memory-mapped file instead of a display, see framebuffer.py", categories=["matrix"], tags=["advanced"])
+        self.set("devices", "", helptext="More displays fed by the same images, ';' separated setting overrides, e.g. 'disc; mock,rows=64'. Read at start", categories=["matrix"], tags=["advanced"])
+        self.set("mock_fps", 30, helptext="Maximum frames per second the mock draws in the terminal", categories=["matrix"], tags=["advanced"])
         self.set(
             "nodisplay", False, helptext="Do not output to a display, including the mock", choices=[False, True], categories=["matrix"], tags=["advanced"]
         )
         self.set(
             "mode",
             "text",
-            helptext="Valid modes are 'text', 'file', 'url', 'slideshow', and 'disc_animations'",
-            choices=["text", "file", "url", "slideshow", "disc_animations"],
+            helptext="Valid modes are 'text', 'file', 'url', 'slideshow', 'playlist', and 'disc_animations'",
+            choices=["text", "file", "url", "slideshow", "playlist", "disc_animations"],
             categories=["matrix"],
         )
+        self.set(
+            "disc_effect",
+            "rainbow",
+            helptext="Polar effect drawn by disc_animations",
+            choices=["rainbow", "gradient", "ripple", "spiral"],
+            categories=["disc_animations"],
+        )
+        self.set("disc_spin", 0, helptext="Degrees to rotate disc_animations each frame", categories=["disc_animations"])
         self.set("gif_frame_no", 0, helptext="Frame number of gif to statically display (when not animating)", categories=["file", "slideshow"], tags=["advanced"])
         self.set("gif_speed", 1.0, helptext="Multiplier for gif animation speed", categories=["file", "slideshow"])
         self.set("gif_loop_delay", 0, helptext="Delay (ms) between repeatations of an animated gif", categories=["file", "slideshow"], tags=["advanced"])
@@ -121,11 +161,23 @@ class HawksSettings(Settings):
         self.set("underscan", 0, helptext="Number of border rows and columns to leave blank", categories=["matrix"])
         self.set("noloop", False, choices=[True, False], helptext="Do not loop animated GIFs", categories=["file", "slideshow"])
         self.set("slideshow_directory", "img", helptext="directory full of images for slideshow", categories=["slideshow"])
-        self.set("slideshow_hold_sec", 10.0, helptext="length of time to display each image in a slideshow", categories=["slideshow"])
-        self.set("slideshow_order", "none", helptext="order in which to display slideshow images", categories=["slideshow"], choices=["none", "random", "alphabetical"])
-        self.set("transition", "none", choices=["none", "fade", "wipeleft", "wiperight", "wipeup", "wipedown", "random"], helptext="Slideshow transition", categories=["slideshow"])
-        self.set("transition_duration_ms", 250, helptext="Slideshow transition duration in ms", categories=["slideshow"])
+        self.set("slideshow_recursive", False, choices=[False, True], helptext="Include images in subdirectories of slideshow_directory", categories=["slideshow"])
+        self.set("slideshow_hold_sec", 10.0, helptext="length of time to display each image in a slideshow", categories=["slideshow", "playlist"])
+        self.set("slideshow_order", "none", helptext="order in which to display slideshow images", categories=["slideshow", "playlist"], choices=["none", "random", "alphabetical"])
+        self.set("slideshow_preload", 2, helptext="Number of slides to prepare ahead of the current one", categories=["slideshow", "playlist"], tags=["advanced"])
+        self.set("slideshow_preload_mb", 16, helptext="Maximum memory (MB) used by prepared slides", categories=["slideshow", "playlist"], tags=["advanced"])
+        self.set("render_cache_dir", ".hawks_render_cache", helptext="Directory for pre-rendered slideshow frames", categories=["slideshow"], tags=["advanced"])
+        self.set("render_cache_mb", 256, helptext="Maximum size of the pre-rendered frame cache in MB", categories=["slideshow"], tags=["advanced"])
+        self.set("thumbnail_cache_dir", ".hawks_thumbnails", helptext="Directory for webui preview thumbnails", categories=["file"], tags=["advanced"])
+        self.set("thumbnail_size", 200, helptext="Size in pixels of webui preview thumbnails", categories=["file"], tags=["advanced"])
+        self.set("transition", "none", choices=["none", "fade", "wipeleft", "wiperight", "wipeup", "wipedown", "random"], helptext="Slideshow transition", categories=["slideshow", "playlist"])
+        self.set("transition_duration_ms", 250, helptext="Slideshow transition duration in ms", categories=["slideshow", "playlist"])
+        self.set("playlist_prefetch", 3, helptext="Number of playlist urls to fetch ahead of the current one", categories=["playlist"], tags=["advanced"])
+        self.set("playlist_load_timeout_sec", 10.0, helptext="Skip playlist urls that take longer than this to load", categories=["playlist"], tags=["advanced"])
         self.set("transition_frames_max", 18, helptext="Max number of frames to render for slideshow transition", categories=["slideshow"], tags=["advanced"])
+        self.set("preview_fps", 10, helptext="Maximum frames per second of the live preview stream", categories=["matrix"], tags=["advanced"])
+        self.set("preview_max_clients", 4, helptext="Maximum number of live preview viewers at once", categories=["matrix"], tags=["advanced"])
+        self.set("show_delay_ms", 100, helptext="Settings changes made within this many ms of each other are applied together", categories=["matrix"], tags=["advanced"])
         self.set("no_webui_one_mode_only", False, choices=[True, False], helptext="Prevent webui from hiding unused mode settings", categories=["matrix"], tags=["advanced"])
 
 
@@ -141,8 +193,12 @@ class HawksSettings(Settings):
 
         super().set(name, value, **kwargs)
         if propagate and self.hawks:
-            setattr(self.hawks.ctrl, name, self.get(name))
-            setattr(self.hawks.img_ctrl, name, self.get(name))
+            if getattr(self.hawks, "img_ctrl", None):
+                setattr(self.hawks.img_ctrl, name, self.get(name))
+            # devices[0] is the main display, the others may override settings
+            for device, overrides in zip(self.hawks.devices, [{}] + self.hawks.device_overrides):
+                if name not in overrides:
+                    setattr(device, name, self.get(name))
 
     def render(self, names):
         """
@@ -205,10 +261,42 @@ class Hawks(Base):
             else:
                 setattr(self, k, v)
 
-        self.frame_queue = Queue()
+        # show() and batches of settings changes hold show_lock, so a batch
+        # is never half applied when show() reads the settings. show_run_lock
+        # keeps two show()s from overlapping.
+        self.show_lock = RLock()
+        self.show_run_lock = RLock()
+        self.show_timer_lock = Lock()
+        self.show_timer = None
+        self.show_done = None
+
+        self.prerender_lock = Lock()
+        self.prerender_status = {}
+        self.screenshot_lock = Lock()
+        self.screenshot_cache = None
+        self.screenshot_count = 0
+        self.screenshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot")
+        self.boot_id = f"{os.getpid():x}{int(time.time()):x}"
 
+        # one ImageController feeds every display, see fanout.py
+        self.device_overrides = fanout.parse_devices(self.settings.devices)
+        if self.device_overrides:
+            self.frame_queue, queues = fanout.FanoutQueue.create(1 + len(self.device_overrides))
+        else:
+            self.frame_queue = Queue()
+            queues = [self.frame_queue]
+
+        self.devices = []
         self.settings.hawks = self
-        self.ctrl = MatrixController(self.frame_queue, self.settings)
+        self.ctrl = MatrixController(queues[0], self.settings)
+        self.devices.append(self.ctrl)
+        for overrides, queue in zip(self.device_overrides, queues[1:]):
+            values = fanout.apply_overrides(self.settings.list(), overrides)
+            device = MatrixController(queue, list(values.items()))
+            device.main = self.ctrl
+            self.devices.append(device)
+        self.preview = preview.PreviewStream(self.settings)
+        self.ctrl.preview = self.preview
         self.img_ctrl = ImageController(self.frame_queue, self.settings)
 
         if preset and preset != "none":
@@ -225,24 +313,127 @@ class Hawks(Base):
         return False
 
     def show(self):
-        self.db(time.time())
-        self.stop()
-        self.img_ctrl = ImageController(self.frame_queue, self.settings)
-        self.img_ctrl.show(self.settings.mode)
-        self.img_ctrl_render_thread = Thread(target=self.img_ctrl.render)
-        self.img_ctrl_render_thread.start()
-        return self.ctrl.show()
+        with self.show_run_lock:
+            with self.show_lock:
+                # ImageControllers read their settings when they are made, from
+                # a snapshot taken between batches of settings changes, so the
+                # slow part of show() runs without holding up /api/set
+                self.db(time.time())
+                self.stop()
+                settings = copy(self.settings)
+                self.img_ctrl = ImageController(self.frame_queue, settings)
+            self.img_ctrl.show(settings.mode)
+            self.img_ctrl_render_thread = Thread(target=self.img_ctrl.render)
+            self.img_ctrl_render_thread.start()
+            self.screenshot_future()
+            start_time = None
+            if len(self.devices) > 1:
+                # give every display the same start, so their frames line up
+                start_time = time.time() + 0.05
+                for device in self.devices[1:]:
+                    device.show(start_time)
+            return self.ctrl.show(start_time)
+
+    def show_soon(self, wait=False, timeout=None):
+        """
+        Schedule a show() show_delay_ms from now, unless one is already
+        scheduled, so that a burst of settings changes causes one rebuild.
+        Returns a Future of the show() result; with wait, waits for it
+        first, raising whatever show() raised.
+        """
+        delay = self.settings.show_delay_ms / 1000.0
+        if delay <= 0:
+            done = Future()
+            done.set_result(self.show())
+            return done
+        with self.show_timer_lock:
+            if self.show_timer is None:
+                self.show_done = Future()
+                self.show_timer = Timer(delay, self.show_scheduled)
+                self.show_timer.daemon = True
+                self.show_timer.start()
+            done = self.show_done
+        if wait:
+            done.result(timeout)
+        return done
+
+    def show_scheduled(self):
+        with self.show_timer_lock:
+            done = self.show_done
+            self.show_timer = None
+        try:
+            done.set_result(self.show())
+        except Exception as e:
+            print(f"Unable to show: {e}")
+            done.set_exception(e)
+
+    def prerender(self, progress=None):
+        """
+        Pre-render slideshow_directory for the current settings into the render
+        cache, using every core. Only one pre-render runs at a time; returns
+        None if one is already running, otherwise the final status.
+        """
+        if not self.prerender_lock.acquire(blocking=False):
+            return None
+        try:
+            def update(status):
+                status["running"] = True
+                self.prerender_status = status
+                if progress:
+                    progress(status)
+
+            status = prerender.prerender_directory(self.settings, progress=update)
+            status["running"] = False
+            self.prerender_status = status
+            return status
+        finally:
+            self.prerender_lock.release()
+
+    def screenshot_future(self):
+        """
+        Start encoding a preview of the current frames in the background,
+        unless one has already been started for them. Returns the cache
+        entry, a dict of etag and a Future of (body, content_type).
+
+        The preview changes when show() makes a new ImageController and when
+        a slideshow moves on to a new slide, both of which replace
+        bright_frames, so the entry is keyed by the identity of that list.
+        It holds a reference to it, so the identity cannot be reused.
+        """
+        img_ctrl = self.img_ctrl
+        frames = img_ctrl.bright_frames
+        with self.screenshot_lock:
+            cached = self.screenshot_cache
+            if cached is None or cached["img_ctrl"] is not img_ctrl or cached["frames"] is not frames:
+                self.screenshot_count += 1
+                cached = self.screenshot_cache = {
+                    "img_ctrl": img_ctrl,
+                    "frames": frames,
+                    "etag": f'"{self.boot_id}-{self.screenshot_count}"',
+                    "future": self.screenshot_executor.submit(img_ctrl.screenshot),
+                }
+        return cached
 
     def screenshot(self):
-        return self.img_ctrl.screenshot()
+        """
+        Returns (etag, body, content_type) of a preview of the current frames.
+        Each set of frames is encoded once; concurrent callers wait on the
+        same encode.
+        """
+        cached = self.screenshot_future()
+        body, content_type = cached["future"].result()
+        return cached["etag"], body, content_type
 
     def stop(self):
         self.img_ctrl.stop()
-        self.ctrl.stop()
+        for device in self.devices:
+            device.stop()
         while not self.frame_queue.empty():
             self.frame_queue.get()
 
     def start(self):
+        for device in self.devices[1:]:
+            device.start()
         return self.ctrl.start()
 
 def unit_tests():
@@ -4,11 +4,14 @@ import api_server
 import http.server
 import json
 import os
-import requests
-import tempfile
+import preview
+import thumbnails
 import time
 
+from base import Base
+from threading import Lock, Thread, Timer
 from urllib.parse import unquote
+from urlcache import UrlValidator
 from webui import Webui
 
 class HawksApiValidationException(Exception):
@@ -27,10 +30,52 @@ def read_urls(hawks):
         pass
     return urls
 
-def run_api(ip, port, hawks):
+class UrlsFileWriter(Base):
+    """
+    Appends newly seen urls to urls_file. Writes are debounced by delay_sec so
+    that a burst of /api/set calls becomes one small append, rather than
+    rewriting the whole file on every call.
+    """
+
+    def __init__(self, hawks, delay_sec=2.0):
+        super().__init__()
+        self.hawks = hawks
+        self.delay_sec = delay_sec
+        self.pending = []
+        self.timer = None
+        self.lock = Lock()
+
+    def add(self, url):
+        with self.lock:
+            self.pending.append(url)
+            if not self.timer:
+                self.timer = Timer(self.delay_sec, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            urls, self.pending = self.pending, []
+            self.timer = None
+        if not urls or not self.hawks.settings.urls_file:
+            return
+        try:
+            with open(self.hawks.settings.urls_file, "a+") as URLS:
+                if URLS.tell() > 0:
+                    URLS.seek(URLS.tell() - 1)
+                    if URLS.read(1) != "\n":
+                        URLS.write("\n")
+                URLS.write("".join(url + "\n" for url in urls))
+        except Exception as e:
+            print(e)
+
+
+def run_api(ip, port, hawks, server="asyncio"):
     api = api_server.Api(prefix="/")
 
     hawks.settings.set("urls", "", choices=read_urls(hawks))
+    url_validator = UrlValidator(timeout=hawks.settings.url_timeout_sec)
+    urls_writer = UrlsFileWriter(hawks)
 
     def tups(parts):
         return ((parts[n], parts[n+1]) for n in range(0, len(parts), 2))
@@ -47,11 +92,16 @@ Hawks API usage:
   /api/get/setting/<key>  Return the value of one setting (404 on error)
   /api/get/<key>          Return the value of one setting (200 w/usage on error)
   /api/get/presets        Return a list of presets
+  /api/get/routes         Return request counts for each API endpoint
   /api/set/<key>/<value>  Modify a current setting. /key/value can be repeated.
-  /api/do/image           Returns a PNG of the current image
+                          Changes are applied together after show_delay_ms;
+                          add /wait/true to return only once they have been.
+  /api/do/image           Returns a PNG (or GIF, if animated) of the current image
+  /api/do/stream          Live MJPEG stream of the frames being displayed
   /api/do/preset/<name>   Apply the named preset
   /api/do/save            Save the current configuration
   /api/do/load            Load a saved configuration
+  /api/do/prerender       Pre-render slideshow_directory in the background, returns progress
 
 Settings:
 {0}
@@ -74,6 +124,9 @@ Settings:
             return req.send(
                 200, body=json.dumps(hawks.settings.dump())
             )
+        if parts[0] == "routes":
+            # GET /api/get/routes, request counts per endpoint, for diagnostics
+            return req.send(200, body=json.dumps(api.route_stats()))
         if parts[0] == "presets":
             # GET /api/presets, dump the list of available presets
             return req.send(200, body=json.dumps(list(hawks.PRESETS.keys())))
@@ -95,12 +148,6 @@ Settings:
         result.extend(list(kwargs.values()))
         return tuple(result)
 
-    def test_url(url):
-        response = requests.head(url)
-        if response.status_code > 299:
-            return False
-        return True
-
     def normalize_data(data):
         """
         Use API-specific knowledge to validate and normalize settings input.
@@ -115,17 +162,12 @@ Settings:
                 value = unquote(value)
                 data[key] = value
                 if key == "url" and value:
-                    if not test_url(value):
+                    if not url_validator.check(value):
                         raise HawksApiValidationException(f"Unable to fetch image from {value}")
                     if value not in hawks.settings.choices["urls"]:
                         hawks.settings.choices["urls"].append(value)
-                    if hawks.settings.urls_file:
-                        try:
-                            URLS = open(hawks.settings.urls_file, "w")
-                            URLS.write("\n".join(hawks.settings.choices["urls"]))
-                            URLS.close()
-                        except Exception as e:
-                            print(e)
+                        hawks.settings.changed()
+                        urls_writer.add(value)
             _val = hawks.settings.get(key)
             if _val is not None:
                 if type(_val) is float:
@@ -168,6 +210,7 @@ Settings:
         except:
             pass
         data.update(dict(tups(req.parts[2:])))
+        wait = str(data.pop("wait", False)).lower() in ["true", "on", "1"]
 
         try:
             data = normalize_data(data)
@@ -175,13 +218,17 @@ Settings:
             return send(e.status_code, body=e.msg)
 
         show = False
-        for key, value in data.items():
-            if hawks.settings.get(key) != value:
-                hawks.settings.set(key, value)
-                show = True
+        with hawks.show_lock:
+            for key, value in data.items():
+                if hawks.settings.get(key) != value:
+                    hawks.settings.set(key, value)
+                    show = True
 
         if show:
-            hawks.show()
+            try:
+                hawks.show_soon(wait=wait)
+            except Exception as e:
+                return send(500, body=f"Internal error: {e}\n")
 
         if msg:
             return send(200, body=msg)
@@ -203,9 +250,19 @@ Settings:
                     req, body="Path must have non-zero, even number of elements"
                 )
         elif parts[0] == "image":
+            etag, body, content_type = hawks.screenshot()
+            if req.headers.get("If-None-Match") == etag:
+                return req.send(304, headers={"ETag": etag})
             return req.send(
-                200, body=hawks.screenshot(), content_type="image/png"
+                200, body=body, content_type=content_type, headers={"ETag": etag, "Cache-Control": "no-cache"}
             )
+        elif parts[0] == "stream":
+            return api_stream(req)
+        elif parts[0] == "prerender":
+            if not hawks.prerender_lock.locked():
+                hawks.prerender_status = {"running": True}
+                Thread(target=hawks.prerender, daemon=True).start()
+            return req.send(200, body=json.dumps(hawks.prerender_status))
         elif parts[0] == "save":
             if parts[1]:
                 hawks.settings.save(parts[1])
@@ -235,10 +292,64 @@ Settings:
         else:
             return usage(req, f"Unknown command: {parts[0]}")
 
+    def api_stream(req):
+        try:
+            frames = hawks.preview.frames()
+            jpeg = next(frames)
+        except preview.PreviewBusy as e:
+            return req.send(503, body=f"{e}\n")
+        req.send_response(200)
+        req.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={hawks.preview.boundary}")
+        req.send_header("Cache-Control", "no-cache")
+        req.send_header("Connection", "close")
+        req.end_headers()
+        try:
+            while True:
+                req.wfile.write(hawks.preview.part(jpeg))
+                req.wfile.flush()
+                jpeg = next(frames)
+        except (BrokenPipeError, ConnectionError):
+            pass
+        finally:
+            frames.close()
+
     def api_fetch(req):
-        with open("/".join(unquote(part) for part in req.parts), "rb") as IMG:
-            img = IMG.read()
-            req.send(200, body=img, content_type="image/jpeg")
+        """
+        /img/<path>, files under the img directory, for the webui preview.
+        """
+        name = "/".join(unquote(part) for part in req.parts[1:]).split("?")[0]
+        if not name or not only_alpha(name):
+            return req.send(400, body=f"Invalid filename: {name}\n")
+        root = os.path.realpath(req.parts[0])
+        path = os.path.realpath(os.path.join(root, name))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            return req.send(404, body=f"No such file: {name}\n")
+        try:
+            api_server.send_file(req, path, headers={"Cache-Control": "no-cache"})
+        except (BrokenPipeError, ConnectionError):
+            pass
+
+    def get_thumbnails():
+        return thumbnails.get_thumbnails(
+            hawks.settings.filepath or "img",
+            cache_dir=hawks.settings.thumbnail_cache_dir,
+            size=hawks.settings.thumbnail_size,
+        )
+
+    def api_thumb(req):
+        """
+        /thumb/<path>, a small JPEG of a file in the img directory.
+        """
+        name = "/".join(unquote(part) for part in req.parts[1:]).split("?")[0]
+        if not name or not only_alpha(name):
+            return req.send(400, body=f"Invalid filename: {name}\n")
+        path = get_thumbnails().get(name)
+        if not path:
+            return req.send(404, body=f"No thumbnail for {name}\n")
+        try:
+            api_server.send_file(req, path, content_type="image/jpeg", headers={"Cache-Control": "no-cache"})
+        except (BrokenPipeError, ConnectionError):
+            pass
 
     def only_alpha(name):
         name = unquote(name)
@@ -258,17 +369,21 @@ Settings:
         usage(req)
 
     webui = Webui(hawks, api_set)
+    # make thumbnails for the webui's file list in the background, ahead of the first request
+    Thread(target=get_thumbnails, daemon=True).start()
 
     api.register_endpoint("default", usage)
     api.register_endpoint("/api", api_get)
     api.register_endpoint("/api/get", api_get)
-    api.register_endpoint("/api/set", api_set)
+    api.register_endpoint("/api/set", api_set, methods=["GET", "POST"])
     api.register_endpoint("/api/do", api_do)
     api.register_endpoint("/help", api_help)
     api.register_endpoint("/api/help", api_help)
     api.register_endpoint("/img", api_fetch)
+    api.register_endpoint("/thumb", api_thumb)
     #if hawks.settings.filepath:
     #    api.register_endpoint(f"/{hawks.settings.filepath}", api_fetch)
+    api.register_endpoint("/webui.js", webui.webui_js)
     api.register_endpoint("/", webui.webui_form, methods=["GET", "POST"])
     # api.register_endpoint("/submit", webui_submit, methods=["POST"])
-    api.run(ip, port)
+    api.run(ip, port, server=server)
@@ -1,21 +1,25 @@
 #!/usr/bin/env python3
 
+import assetindex
 import disc
 import io
 import json
 import math
 import os
-import requests
+import polar
+import prerender
 import sys
-import tempfile
 import time
+import urlcache
 from base import Base
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from copy import copy
 from math import pi, sin
 from matrixcontroller import MatrixController
 from PIL import Image, ImageDraw, ImageFont, ImageColor, GifImagePlugin, UnidentifiedImageError
-from random import randint, choice
-from threading import Timer
+from random import randint, choice, shuffle
+from threading import Condition, Thread, Timer
 from urllib.parse import unquote
 
 
@@ -67,6 +71,9 @@ class ImageController(Base):
         self.animation = None
         self.filter = None
         self.queue_target_depth = 20
+        self.queue_target_ms = 2000
+        self.queued_until = 0
+        self.slides = None
         self.render_calls = 0
         self.go = True
         self.img_ctrl = None
@@ -110,11 +117,22 @@ class ImageController(Base):
             #self.ctrl.disc_animations()
             img_ctrl = DiscAnimationsImageController(self.settings)
         elif mode == "slideshow":
-            img_ctrl = SlideshowImageController(self.settings)
+            self.slides = SlideshowImageController(self.settings)
+        elif mode == "playlist":
+            self.slides = URLPlaylistImageController(self.settings)
         else:
             img_ctrl = TextImageController(self.settings)
 
-        if img_ctrl:
+        if self.slides:
+            # Slides come back already transformed, one whole slide per render()
+            # call. We play each one through once, then ask for the next.
+            self.img_ctrl = self.slides
+            self.static_frames = self.slides.render()
+            self.bright_frames = self.slides.bright_frames
+            self.noloop = True
+            self.frame_no = -1
+            self.direction = 1
+        elif img_ctrl:
             self.img_ctrl = img_ctrl
             frames = img_ctrl.render()
             if type(frames) == list:
@@ -124,11 +142,12 @@ class ImageController(Base):
                     frames = getattr(img_ctrl, "filter_" + self.filter)(frames)
 
                 self.static_frames, self.bright_frames = self.transform(frames)
+                Thread(target=self.shape_ahead, args=(list(self.static_frames),), daemon=True).start()
                 self.frame_no = -1
                 self.direction = 1
             else:
-                self.frame_queue.put(frames)
-        if self.static_frames and self.transition != "none":
+                self.put_frame(frames)
+        if self.static_frames and self.transition != "none" and not self.slides:
                 prev_frame = self.hawks.ctrl.frame
                 next_frame = self.static_frames[0]
                 # some function that shoves frames into the queue, < the queue depth
@@ -142,6 +161,16 @@ class ImageController(Base):
         self.go = False
         if getattr(self, "timer", None):
             self.timer.cancel()
+        if self.img_ctrl and self.img_ctrl is not self:
+            self.img_ctrl.stop()
+
+    def shape_ahead(self, frames):
+        """
+        Have each display's MatrixController shape frames now, rather than
+        as each one comes up.
+        """
+        for ctrl in getattr(self.hawks, "devices", []):
+            ctrl.shape_ahead(frames)
 
     def next_static_frame(self):
         self.frame_no += self.direction
@@ -158,6 +187,17 @@ class ImageController(Base):
             self.frame_no = 0
         return self.static_frames[self.frame_no]
 
+    def put_frame(self, frame):
+        """
+        Queue a frame, keeping track of when the queue will run dry so that
+        render() knows how long it can sleep.
+        """
+        self.queued_until = max(self.queued_until, time.time()) + (frame[1] or 0) / 1000.0
+        self.frame_queue.put(frame)
+
+    def queued_sec(self):
+        return self.queued_until - time.time()
+
     def render(self):
         #self.render_calls += 1
         #print(f"{self.render_calls}, {self.frame_queue.qsize()}")
@@ -167,17 +207,36 @@ class ImageController(Base):
             return
         if not self.static_frames and not self.img_ctrl:
             return
-        while self.frame_queue.qsize() < self.queue_target_depth:
+        holding = False
+        while (
+            self.frame_queue.qsize() < self.queue_target_depth
+            and self.queued_sec() < self.queue_target_ms / 1000.0
+        ):
             if self.static_frames:
                 frame = self.next_static_frame()
+                if frame is None and self.slides:
+                    self.static_frames = self.slides.render()
+                    self.bright_frames = self.slides.bright_frames
+                    self.frame_no = -1
+                    frame = self.next_static_frame()
+                    if frame and self.slides.holding:
+                        # the next slide is not staged yet. Let the queue run down to
+                        # one 100ms hold and check again every 100ms, so the slide goes
+                        # up as soon as it is staged instead of behind queued holds.
+                        if self.queued_sec() < 0.100:
+                            self.put_frame(frame)
+                        holding = True
+                        break
             elif self.img_ctrl:
                 frame = self.img_ctrl.render()
             else:
                 break
             if not frame:
                 return
-            self.frame_queue.put(frame)
-        self.timer = Timer(0.100, self.render)
+            self.put_frame(frame)
+        # a long frame (a held slide) lets us sleep until the queue runs low
+        delay = 0.100 if holding else max(0.100, self.queued_sec() - self.queue_target_ms / 2000.0)
+        self.timer = Timer(delay, self.render)
         self.timer.start()
 
     def transform(self, static_frames):
@@ -286,7 +345,7 @@ class ImageController(Base):
             if static:
                 static_frames.append((image, duration))
             else:
-                self.frame_queue.put((image, duration))
+                self.put_frame((image, duration))
         if static:
             return static_frames
 
@@ -320,7 +379,7 @@ class ImageController(Base):
             if static:
                 static_frames.append((image, duration))
             else:
-                self.frame_queue.put((image, duration))
+                self.put_frame((image, duration))
         if static:
             return static_frames
 
@@ -611,12 +670,15 @@ class ImageController(Base):
             return output.getvalue()
 
     def screenshot(self):
+        """
+        Returns (body, content_type), a PNG of a still or a GIF of an animation.
+        """
         if self.bright_frames:
             if len(self.bright_frames) == 1:
-                return self.make_png(self.bright_frames[0][0])
+                return self.make_png(self.bright_frames[0][0]), "image/png"
             else:
-                return self.make_gif(self.bright_frames)
-        return self.make_png(Image.new("RGB", (self.active_cols, self.active_rows), "black"))
+                return self.make_gif(self.bright_frames), "image/gif"
+        return self.make_png(Image.new("RGB", (self.active_cols, self.active_rows), "black")), "image/png"
 
     def apply_transformations(self, image, max_brightness=False):
         if not getattr(self, "disc", None):
@@ -969,19 +1031,49 @@ class FileImageController(ImageController):
         self.cols = self.active_cols
         self.rows = self.active_rows
 
+    def open_image(self):
+        return Image.open(unquote(self.filename))
+
     def render(self):
         try:
-            image = Image.open(unquote(self.filename))
+            image = self.open_image()
         except UnidentifiedImageError as e:
             print(f"Unable to open image file {self.filename}: {e}")
             return []
 
         if hasattr(image, "is_animated") and image.is_animated:
-            return GifFileImageController(self.settings).render()
+            with image:
+                return self.gif_frames(image)
 
         image = image.convert("RGB")
         return [(image, 0)]
 
+    def gif_frames(self, gif):
+        frames = []
+        for n in range(0, gif.n_frames):
+            gif.seek(n)
+            image = gif.convert("RGB")
+            if self.animate_gifs:
+                try:
+                    duration = int(gif.info["duration"])
+                except KeyError:
+                    duration = 0
+                if duration == 0 and not self.no_gif_override_duration_zero:
+                    duration = 100
+                if n == gif.n_frames - 1:
+                    duration += self.gif_loop_delay * self.gif_speed  # hack
+            else:
+                if n == self.gif_frame_no:
+                    duration = 0
+                else:
+                    duration = 1
+            duration = int(duration * (1 / self.gif_speed))
+            frames.append((image, duration))
+            if not duration:
+                # -0 duration frame will be shown forever, no value in rendering any more
+                break
+        return frames
+
 
 class GifFileImageController(FileImageController):
     def __init__(self, settings):
@@ -990,197 +1082,371 @@ class GifFileImageController(FileImageController):
         self.init_frames()
 
     def init_frames(self):
-        self.frames = []
-        with Image.open(unquote(self.filename)) as gif:
-            for n in range(0, gif.n_frames):
-                gif.seek(n)
-                image = gif.convert("RGB")
-                if self.animate_gifs:
-                    try:
-                        duration = int(gif.info["duration"])
-                    except KeyError:
-                        duration = 0
-                    if duration == 0 and not self.no_gif_override_duration_zero:
-                        duration = 100
-                    if n == gif.n_frames - 1:
-                        duration += self.gif_loop_delay * self.gif_speed  # hack
-                else:
-                    if n == self.gif_frame_no:
-                        duration = 0
-                    else:
-                        duration = 1
-                duration = int(duration * (1 / self.gif_speed))
-                self.frames.append((image, duration))
-                if not duration:
-                    # -0 duration frame will be shown forever, no value in rendering any more
-                    return
+        with self.open_image() as gif:
+            self.frames = self.gif_frames(gif)
 
     def render(self):
         return self.frames
 
 
 class URLImageController(FileImageController):
+    """
+    Fetches self.url through the shared UrlCache and decodes the image
+    straight from memory.
+    """
+
     def __init__(self, settings):
         self.settings = settings
+        self.url_cache_dir = ".hawks_cache"
+        self.url_cache_mb = 32
+        self.url_cache_fresh_sec = 60
+        self.url_timeout_sec = 5.0
         super().__init__(settings)
         self.cols = self.active_cols
         self.rows = self.active_rows
-        self.filename = tempfile.mktemp()
-        self.settings.filename = self.filename
-        self.fetch_image()
+        self.filename = self.url
+        self.content = self.fetch_image()
 
     def fetch_image(self):
-        response = requests.get(self.url)
-        if response.status_code != 200:
-            raise Exception("Error fetching {}: status code {}".format(self.url, response.status_code))
-        with open(self.filename, "wb") as TMPFILE:
-            TMPFILE.write(response.content)
+        cache = urlcache.get_cache(
+            self.url_cache_dir,
+            max_bytes=self.url_cache_mb * 1024 * 1024,
+            fresh_sec=self.url_cache_fresh_sec,
+            timeout=self.url_timeout_sec,
+        )
+        return cache.get(self.url)
 
-    def render(self):
-        frames = FileImageController(self.settings).render()
-        os.unlink(self.filename)
-        return frames
+    def open_image(self):
+        return Image.open(io.BytesIO(self.content))
 
 
 class SlideshowImageController(ImageController):
     """
     SlideshowImageController will loop forever over all of the files in
-    settings.slideshow_directory, loading one and then returning single
-    frames from it from render() until it is time to load the next file.
-    If the file is an animation, it will continue to return frames from
-    that file until all of the frames have been returned at least once,
-    even if the time to do so exceeds settings.slideshow_hold_sec.
-
-    Disconnecting the loading and storage of the frames from each of the
-    files from ImageController's own static_frames mechanic makes it simpler
-    for SlideshowImageController to contol which frames get returned when,
-    but makes it more complicated to play a set of pre-rendered frames from
-    the frame_queue while a new set of frames is loaded from the next file.
-
-    In fact, it does no pre-loading at all, and it will wait until
-    ImageController calls its render() after the current file's time is
-    done before it even begins loading the next image. This is only noticable
-    when one animation is followed by a long animation, which takes some time
-    to load.
-
-    Even with pre-loading, this is a more computationally expensive way to
-    display still images. Building more direct support for slideshows into
-    ImageController or making the interactions between ImageController and its
-    children more flexible would be a nice improvement to this feature. There
-    is no reason for ImageController to keep asking SlideshowImageControler
-    to render the same frame over and over when everyone could know that that
-    frame has to stay up for settings.slideshow_hold_sec. Same could be true
-    for animations, as there is no reason why ImageController shouldn't use
-    its existing static_frames mechanic and itself understand when to call
-    SlideshowImageController.render() again.
+    settings.slideshow_directory. Each call to render() returns every frame
+    of the next slide, already transformed: the transition into it, then
+    its frames for settings.slideshow_hold_sec. ImageController plays them
+    through its static_frames mechanic and calls render() again when they
+    run out. A still image is a single frame whose duration is the whole
+    hold, so nothing wakes up until the next slide is due. If the file is
+    an animation, its frames are repeated to fill the hold, and it will
+    play all of its frames at least once, even if the time to do so
+    exceeds settings.slideshow_hold_sec.
+
+    Slides are prepared by a background thread, started on the first call
+    to render(). It loads, filters and transforms the next
+    slideshow_preload slides, along with the transition frames into each
+    of them, while the current slide is held, so render() only has to swap
+    in a slide that is already staged. The thread stops staging when
+    slideshow_preload slides or slideshow_preload_mb of frames are waiting.
+    If the next slide is not staged in time, render() holds the current
+    one for another 100ms rather than blanking, and sets holding so that
+    ImageController lets its queue run down to that one frame and checks
+    again every 100ms.
+    The first call to render() waits at most first_slide_wait_sec for the
+    first slide; until it is ready, render() holds black the same way.
     """
 
+    first_slide_wait_sec = 1.0
+
     def __init__(self, settings):
+        self.slideshow_preload = 2
+        self.slideshow_preload_mb = 16
+        self.slideshow_recursive = False
+        self.render_cache_dir = ""
         super().__init__(None, settings)
-        self.files = os.listdir(self.slideshow_directory)
+        self.files = self.list_files()
         if self.slideshow_order == "alphabetical":
             self.files.sort()
         elif self.slideshow_order == "random":
             self.randomize_files()
         self.fileno = 0
-        self.static_frames = []
-        self.frameno = 0
-        self.transition_frames = []
-        self.transition_frameno = 0
         self.hold_time_ms = self.slideshow_hold_sec * 1000
-        self.frame_target = 0
-        self.frame_count = 0
-        self.new_image = True
         self.frame = None
+        self.staged = deque()
+        self.staged_bytes = 0
+        self.staged_cond = Condition()
+        self.preload_thread = None
+        self.waited_for_first = False
+        # True when render() returned a 100ms hold rather than a slide
+        self.holding = False
+
+    def list_files(self):
+        self.index = assetindex.get_index(self.slideshow_directory)
+        self.index_version = self.index.version
+        return list(self.index.paths(recursive=self.slideshow_recursive))
 
     def randomize_files(self):
-        new_list = []
-        while self.files:
-            new_list.append(self.files.pop(randint(0, len(self.files)-1)))
-        self.files = new_list
+        shuffle(self.files)
 
-    def next_filename(self, recursion_count=0):
+    def next_filename(self):
         fullpath = os.path.join(self.slideshow_directory, self.files[self.fileno])
         self.fileno += 1
         if self.fileno >= len(self.files):
             self.fileno = 0
+            if self.index.version != self.index_version:
+                # pick up files added or removed since the last pass
+                self.files = self.list_files()
             if self.slideshow_order == "random":
                 self.randomize_files()
-        if os.path.isdir(fullpath):
-            if recursion_count >= len(self.files):
-                raise Exception(f"Path contains only directories: {self.slideshow_directory}")
-            return self.next_filename(recursion_count=recursion_count+1)
         return fullpath
 
+    def filter_and_transform(self, frames):
+        if self.filter and self.filter != "none":
+            frames = getattr(self, "filter_" + self.filter)(frames)
+        return self.transform(frames)
+
+    def load_transformed(self):
+        """
+        Return (path, static_frames, bright_frames) for the next slide,
+        (path, [], []) if it could not be loaded, or None if it is not ready
+        yet. Files that have been pre-rendered for the current settings come
+        straight from the render cache.
+
+        This runs on the preload thread, so it must not touch self.fullpath,
+        which render() sets for the slide that is playing.
+        """
+        if not self.files:
+            self.files = self.list_files()
+            if not self.files:
+                return None, [], []
+        path = self.next_filename()
+        cache = None
+        if self.render_cache_dir and os.path.isdir(self.render_cache_dir):
+            # only pre-rendering creates the cache, don't make an empty one here
+            cache = prerender.get_cache(self.render_cache_dir)
+        if cache:
+            cached = cache.get(path, self.settings)
+            if cached:
+                return (path,) + tuple(cached)
+        settings = copy(self.settings)
+        settings.set("filename", path, propagate=False)
+        frames = FileImageController(settings).render()
+        if not frames:
+            return path, [], []
+        return (path,) + tuple(self.filter_and_transform(frames))
+
+    def prepare_slide(self, prev_frame):
+        """
+        Load, filter and transform the next slide, and work out how many
+        frames to show from it. prev_frame is the last frame that will be
+        shown from the previous slide, used to render the transition.
+        Returns None if the next slide is not ready yet.
+        """
+        loaded = self.load_transformed()
+        if loaded is None:
+            return None
+        path, static_frames, bright_frames = loaded
+        slide = {"path": path, "transition_frames": [], "hold_ms": self.hold_time_ms}
+        if not static_frames:
+            blank = self.blank()
+            slide.update({"static_frames": [(blank, 100)], "bright_frames": [(blank, 100)], "frame_target": 1, "hold_ms": 100})
+            slide["last_frame"] = None
+            slide["bytes"] = 0
+            return slide
+
+        duration = sum(f[1] or 100 for f in static_frames)
+        if duration > self.hold_time_ms:
+            frame_target = len(static_frames)
+        else:
+            i = 0
+            whole_reps = int(self.hold_time_ms / duration)
+            frame_target = len(static_frames) * whole_reps
+            if not self.gif_repeat_whole_times:
+                while duration < self.hold_time_ms:
+                    duration += static_frames[i][1] or 100
+                    frame_target += 1
+                    i += 1
+                    if i >= len(static_frames):
+                        i = 0
+        slide["last_frame"] = static_frames[(frame_target - 1) % len(static_frames)]
+
+        if self.transition and self.transition != "none" and prev_frame:
+            slide["transition_frames"] = self.do_transition(prev_frame, static_frames[0], static=True) or []
+            frame_target += len(slide["transition_frames"])
+
+        self.shape_ahead(slide["transition_frames"] + static_frames)
+        slide["static_frames"] = static_frames
+        slide["bright_frames"] = bright_frames
+        slide["frame_target"] = frame_target
+        slide["bytes"] = sum(
+            frame[0].width * frame[0].height * 3
+            for frame in static_frames + bright_frames + slide["transition_frames"]
+        )
+        return slide
+
+    def preload(self):
+        """
+        Background thread: keep up to slideshow_preload slides staged.
+        """
+        prev_frame = None
+        max_bytes = self.slideshow_preload_mb * 1024 * 1024
+        while self.go:
+            try:
+                slide = self.prepare_slide(prev_frame)
+            except Exception as e:
+                if self.go:
+                    print(f"Unable to prepare slide: {e}")
+                slide = None
+            if slide is None:
+                time.sleep(0.1)
+                continue
+            prev_frame = slide["last_frame"]
+            with self.staged_cond:
+                while self.go and self.staged and (
+                    len(self.staged) >= self.slideshow_preload or self.staged_bytes + slide["bytes"] > max_bytes
+                ):
+                    self.staged_cond.wait()
+                if not self.go:
+                    return
+                self.staged.append(slide)
+                self.staged_bytes += slide["bytes"]
+                self.staged_cond.notify_all()
+
+    def next_slide(self, timeout=0):
+        if not self.preload_thread:
+            self.preload_thread = Thread(target=self.preload, daemon=True)
+            self.preload_thread.start()
+        with self.staged_cond:
+            if timeout:
+                self.staged_cond.wait_for(lambda: self.staged or not self.go, timeout=timeout)
+            if not self.staged:
+                return None
+            slide = self.staged.popleft()
+            self.staged_bytes -= slide["bytes"]
+            self.staged_cond.notify_all()
+            return slide
+
+    def stop(self):
+        super().stop()
+        with self.staged_cond:
+            self.staged_cond.notify_all()
+
     def render(self):
-        if self.frame_count >= self.frame_target:
-            self.fullpath = self.next_filename()
-            settings = copy(self.settings)
-            settings.set("filename", self.fullpath, propagate=False)
-            self.frame_target = 0
-            img_ctrl = FileImageController(settings)
-            if not img_ctrl:
-                return (self.blank(), 100)
-            frames = img_ctrl.render()
-            if not frames:
-                return (self.blank(), 100)
-            if self.filter and self.filter != "none":
-                frames = getattr(img_ctrl, "filter_" + self.filter)(frames)
-            self.static_frames, self.bright_frames = self.transform(frames)
-            self.new_image = True
-            self.transition_frames = []
-            self.frameno = 0
-            self.frame_count = 0
-            duration = sum(f[1] or 100 for f in self.static_frames)
-            if duration > self.hold_time_ms:
-                self.noloop = True
-                self.frame_target = len(self.static_frames)
-            else:
-                self.noloop = False
-                i = 0
-                whole_reps = int(self.hold_time_ms / duration)
-                self.frame_target = len(self.static_frames) * whole_reps
-                if not self.gif_repeat_whole_times:
-                    while duration < self.hold_time_ms:
-                        duration += self.static_frames[i][1] or 100
-                        self.frame_target += 1
-                        i += 1
-                        if i >= len(self.static_frames):
-                            i = 0
-
-        if self.new_image:
-            self.new_image = False
-            if self.transition and self.transition != "none" and self.frame and self.static_frames:
-                self.transition_frames = self.do_transition(self.frame, self.static_frames[0], static=True)
-                if self.transition_frames:
-                    self.transition_frameno = 0
-                    transition_duration_ms = sum(frame[1] for frame in self.transition_frames)
-                    self.frame_target += len(self.transition_frames)
-
-        if self.transition_frames:
-            frame = self.transition_frames[self.transition_frameno]
-            self.transition_frameno += 1
-            if self.transition_frameno >= len(self.transition_frames):
-                self.transition_frames = []
-            self.frame_count += 1
-            return frame
-
-        if self.static_frames:
-            frame = self.static_frames[self.frameno]
-            thisframeno = self.frameno
-            if self.frameno < len(self.static_frames) - 1:
-                self.frameno += 1
-            elif self.noloop:
-                self.frame_target = 0
-            else:
-                self.frameno = 0
-            if frame[1] == 0:
-                frame = (frame[0], 100)
-            self.frame = frame
-            self.frame_count += 1
-            return frame  
+        timeout = 0
+        if self.frame is None and not self.waited_for_first:
+            # wait a little for the very first slide, when there is nothing to hold.
+            # Not for long: show() calls this, and /api/set/.../wait/true waits for show()
+            timeout = self.first_slide_wait_sec
+            self.waited_for_first = True
+        slide = self.next_slide(timeout=timeout)
+        self.holding = slide is None
+        if slide is None:
+            # keep the current slide up a little longer rather than blanking
+            if self.frame:
+                return [(self.frame[0], 100)]
+            return [(self.blank(), 100)]
+        self.fullpath = slide["path"]
+        self.bright_frames = slide["bright_frames"]
+
+        frames = list(slide["transition_frames"])
+        static_frames = slide["static_frames"]
+        if len(static_frames) == 1:
+            frames.append((static_frames[0][0], max(slide["hold_ms"], static_frames[0][1])))
+        else:
+            count = slide["frame_target"] - len(slide["transition_frames"])
+            for n in range(count):
+                image, duration = static_frames[n % len(static_frames)]
+                frames.append((image, duration or 100))
+        self.frame = frames[-1]
+        return frames
+
+
+class URLPlaylistImageController(SlideshowImageController):
+    """
+    URLPlaylistImageController rotates through the known image urls in
+    settings.choices["urls"] the way SlideshowImageController rotates
+    through a directory.
+
+    The network is the slow part, so the next playlist_prefetch urls are
+    fetched and decoded in a thread pool while the current slide is held.
+    When the next slide is not ready yet, render() keeps returning the
+    current one. A url that fails to load, or that takes longer than
+    playlist_load_timeout_sec, is skipped.
+    """
+
+    def __init__(self, settings):
+        self.playlist_prefetch = 3
+        self.playlist_load_timeout_sec = 10.0
+        super().__init__(settings)
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, self.playlist_prefetch))
+        # after a pass over the playlist in which nothing loaded, wait before trying again
+        self.failed_passes = 0
+        self.retry_at = 0
 
-        return (self.blank(), 100)
+    def list_files(self):
+        return list(self.settings.choices.get("urls") or [])
+
+    def next_filename(self):
+        url = self.files[self.fileno]
+        self.fileno += 1
+        if self.fileno >= len(self.files):
+            self.fileno = 0
+            if self.slideshow_order == "random":
+                self.randomize_files()
+        return url
+
+    def fetch_frames(self, url):
+        settings = copy(self.settings)
+        settings.set("url", url, propagate=False)
+        return URLImageController(settings).render()
+
+    def fill_prefetch(self):
+        while self.files and len(self.pending) < max(1, self.playlist_prefetch):
+            url = self.next_filename()
+            self.pending.append((url, self.executor.submit(self.fetch_frames, url)))
+
+    def load_next(self):
+        """
+        Return (url, frames) for the next url that loads, with its frames
+        untransformed, (None, []) if there are no urls, or None if nothing
+        loaded. Tries each url at most
+        once per call; after a call in which none loaded, returns None
+        without trying until a backoff of up to 60s has passed.
+        """
+        if not self.files:
+            return None, []
+        if time.time() < self.retry_at:
+            return None
+        self.fill_prefetch()
+        for attempt in range(len(self.files)):
+            url, future = self.pending.popleft()
+            if not future.done():
+                # the timeout runs from when the slide is needed, not from when it was
+                # queued. load_next() runs on the preload thread, so it is fine to wait here
+                wait([future], timeout=self.playlist_load_timeout_sec)
+            self.fill_prefetch()
+            if not future.done():
+                print(f"Skipping {url}: not loaded after {self.playlist_load_timeout_sec}s")
+                future.cancel()
+                continue
+            try:
+                frames = future.result()
+            except Exception as e:
+                print(f"Skipping {url}: {e}")
+                continue
+            if frames:
+                self.failed_passes = 0
+                return url, frames
+        self.failed_passes += 1
+        delay = min(60, 2 ** self.failed_passes)
+        print(f"No playlist url loaded, trying again in {delay}s")
+        self.retry_at = time.time() + delay
+        return None
+
+    def load_transformed(self):
+        loaded = self.load_next()
+        if loaded is None:
+            return None
+        url, frames = loaded
+        if not frames:
+            return url, [], []
+        return (url,) + tuple(self.filter_and_transform(frames))
+
+    def stop(self):
+        super().stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 
 class NetworkWeatherImageController(ImageController):
@@ -1288,7 +1554,7 @@ class NetworkWeatherImageController(ImageController):
         If the data has changed, call network_weather_anim_setup()
         """
         try:
-            response = requests.get("https://status.cloud.google.com/incidents.json")
+            response = urlcache.get_session().get("https://status.cloud.google.com/incidents.json", timeout=10)
             if response.status_code == 200:
                 new_network_weather_data = json.loads(response.text)
                 if new_network_weather_data != self.network_weather_data:
@@ -1299,8 +1565,15 @@ class NetworkWeatherImageController(ImageController):
 
 
 class DiscAnimationsImageController(ImageController):
+    """
+    Draws polar effects directly in disc pixels, see polar.py. Frames are
+    255-element lists, which MatrixController passes to the disc unsampled.
+    """
+
     def __init__(self, settings):
         self.settings = settings
+        self.disc_effect = "rainbow"
+        self.disc_spin = 0
         super().__init__(None, settings)
         self.cols = self.active_cols
         self.rows = self.active_rows
@@ -1309,17 +1582,44 @@ class DiscAnimationsImageController(ImageController):
         for circle in disc.Disc.circles:
             self.circle_colors.append(color)
             color += 100
+        self.tick = 0
+        self.angle = 0.0
+        level = self.brightness / 255.0
+        self.palette = [polar.scale(self.rainbow_color_from_value(value), level) for value in range(0, 1024, 8)]
 
-    def render(self):
-        frame = []
+    def effect_rainbow(self):
+        rings = []
         for idx, circle in enumerate(disc.Disc.circles):
             color = self.rainbow_color_from_value(self.circle_colors[idx])
-            for n in range(0, circle[1]):
-                frame.append(color)
+            rings.append([color] * circle[1])
             self.circle_colors[idx] += 7
             if self.circle_colors[idx] >= 1024:
                 self.circle_colors[idx] = 0
-        return (frame, 50)
+        return polar.PolarFrame(rings)
+
+    def effect_gradient(self):
+        if not getattr(self, "gradient", None):
+            level = self.brightness / 255.0
+            self.gradient = polar.radial_gradient(
+                polar.scale(ImageColor.getrgb(self.innercolor), level),
+                polar.scale(ImageColor.getrgb(self.outercolor), level),
+            )
+        return self.gradient
+
+    def effect_ripple(self):
+        return polar.ripple(self.palette[(self.tick // 4) % len(self.palette)], (self.tick % 40) / 40.0)
+
+    def effect_spiral(self):
+        return polar.spiral(self.palette, (self.tick % 100) / 100.0, arms=2)
+
+    def render(self):
+        effect = getattr(self, "effect_" + str(self.disc_effect), self.effect_rainbow)
+        frame = effect()
+        if self.disc_spin:
+            self.angle = (self.angle + float(self.disc_spin)) % 360
+            frame = frame.rotate(self.angle)
+        self.tick += 1
+        return (frame.pixels(), 50)
 
 
 def main():
@@ -2,10 +2,69 @@
 
 import math
 import time
+import weakref
 from base import Base
-from PIL import Image
+from collections import OrderedDict
+from PIL import Image, ImageOps
 from queue import Queue
-from threading import Timer
+from threading import Lock, RLock, Timer
+
+
+PANEL_LAYOUTS = ["stack", "serpentine", "u"]
+
+PANEL_ROTATIONS = {
+    0: None,
+    90: Image.ROTATE_90,
+    180: Image.ROTATE_180,
+    270: Image.ROTATE_270,
+}
+
+
+def compile_panel_map(rows, cols, p_rows, p_cols, panel_cols=0, layout="stack", rotate=0):
+    """
+    Work out how to cut a rows x cols image into panel_cols x p_rows tiles
+    and lay them end to end along a p_cols x p_rows panel chain.
+
+    Returns (transpose, size, ops). transpose is applied to the image first
+    (for chains mounted rotated), size is the image size after it, and ops
+    is a list of (box, dest, flip): crop box from the image, turn it upside
+    down if flip, and paste it at dest in the chain. panel_cols of 0 means
+    each tile is the full width of the image.
+
+    layout is the order the chain visits the tiles:
+        stack       row by row, left to right
+        serpentine  row by row, reversing direction on every other row,
+                    where the panels are mounted upside down
+        u           column by column, top to bottom then back up the
+                    next column, where the panels are mounted upside down
+    """
+    transpose = PANEL_ROTATIONS.get(int(rotate or 0))
+    if transpose in (Image.ROTATE_90, Image.ROTATE_270):
+        rows, cols = cols, rows
+    tile_cols = panel_cols or cols
+    tile_rows = p_rows
+    grid_cols = max(1, cols // tile_cols)
+    grid_rows = max(1, rows // tile_rows)
+
+    order = []
+    if layout == "u":
+        for c in range(grid_cols):
+            up = c % 2 == 1
+            for r in (reversed(range(grid_rows)) if up else range(grid_rows)):
+                order.append((r, c, up))
+    else:
+        for r in range(grid_rows):
+            back = layout == "serpentine" and r % 2 == 1
+            for c in (reversed(range(grid_cols)) if back else range(grid_cols)):
+                order.append((r, c, back))
+
+    ops = []
+    for n, (r, c, flip) in enumerate(order):
+        if n * tile_cols >= p_cols:
+            break
+        box = (c * tile_cols, r * tile_rows, (c + 1) * tile_cols, (r + 1) * tile_rows)
+        ops.append((box, (n * tile_cols, 0), flip))
+    return transpose, (cols, rows), ops
 
 
 class MatrixController(Base):
@@ -24,6 +83,8 @@ class MatrixController(Base):
         self.decompose = False
         self.disc = False
         self._disc = None
+        self.disc_sample = "circle"
+        self.disc_sample_radius = 1
         self.mock = False
         self.debug = False
         self.frames = []
@@ -34,6 +95,28 @@ class MatrixController(Base):
         self.nodisplay = False
         self.img_ctrl = None
         self.row_address_type = 0
+        self.panel_cols = 0
+        self.mock_fps = 30
+        self.framebuffer = ""
+        self.panel_layout = "stack"
+        self.panel_rotate = 0
+        self.panel_map = None
+        self.panel_map_key = None
+        self.shape_cache_mb = 16
+        self.shape_cache = OrderedDict()
+        self.shape_cache_bytes = 0
+        self.shape_cache_key = None
+        # weak references to sources that have been freed, see shaped()
+        self.shape_dead = []
+        self.shape_lock = Lock()
+        self.canvas = None
+        self.pending = None
+        self.pending_source = None
+        self.frame_source = None
+        self.preview = None
+        # the main display, for the others when driving several, see fanout.py
+        self.main = None
+        self.render_lock = RLock()
 
         for (k, v) in self.settings:
             setattr(self, k, v)
@@ -52,10 +135,13 @@ class MatrixController(Base):
 
         if self.disc:
             import disc
-            self._disc = disc.Disc(mock=self.mock)
+            self._disc = disc.Disc(mock=self.mock, mock_fps=self.mock_fps)
             self.dot_frames = [(self._disc.sample_image(self.blank), 0)]
         else:
-            if self.mock:
+            if self.framebuffer:
+                from framebuffer import FramebufferMatrix as RGBMatrix
+                from mock import RGBMatrixOptions
+            elif self.mock:
                 from mock import RGBMatrix, RGBMatrixOptions
             else:
                 try:
@@ -73,12 +159,17 @@ class MatrixController(Base):
 
             options.chain_length = 1
             if self.decompose:
-                options.chain_length = 2
                 if not self.p_rows or self.p_rows == self.rows:
                     self.p_rows = int(self.rows / 2)
                     self.p_cols = int(2 * self.cols)
-                m_cols = self.cols
+                transpose, size, ops = self.get_panel_map()
+                m_cols = self.panel_cols or size[0]
                 m_rows = self.p_rows
+                options.chain_length = max(1, int(self.p_cols / m_cols))
+                if self.mock:
+                    # lets the mock put the chain back together the way the
+                    # panels are physically arranged
+                    options.panel_map = self.panel_map
 
             options.cols = m_cols
             options.rows = m_rows
@@ -89,7 +180,13 @@ class MatrixController(Base):
                                     # https://github.com/hzeller/rpi-rgb-led-matrix#troubleshooting
             )
             print(options.cols, options.rows, options.chain_length)
-            self.matrix = RGBMatrix(options=options)
+            if self.mock:
+                options.mock_fps = self.mock_fps
+            if self.framebuffer:
+                self.matrix = RGBMatrix(self.framebuffer, options=options)
+            else:
+                self.matrix = RGBMatrix(options=options)
+            self.canvas = self.matrix.CreateFrameCanvas()
 
         self.show()
 
@@ -106,6 +203,28 @@ class MatrixController(Base):
         self.frame_queue.put((image, 0))
         self.show()
 
+    def panel_settings(self):
+        return (
+            self.rows,
+            self.cols,
+            self.p_rows,
+            self.p_cols,
+            self.panel_cols,
+            self.panel_layout,
+            self.panel_rotate,
+        )
+
+    def get_panel_map(self):
+        """
+        compile_panel_map() for the current settings, compiled again only
+        when they change.
+        """
+        key = self.panel_settings()
+        if key != self.panel_map_key:
+            self.panel_map = compile_panel_map(*key)
+            self.panel_map_key = key
+        return self.panel_map
+
     def reshape(self, image):
         """
         Map image of size self.rows x self.cols to fit a
@@ -121,31 +240,146 @@ class MatrixController(Base):
                             CCCCCCCC  |-->
                             CCCCCCCC  |-->
 
-        Build a new Image of panel_rows x panel_cols.
+        Build a new Image of panel_rows x panel_cols. The mapping is
+        compiled once per geometry by compile_panel_map() into a short
+        list of crop and paste operations, see panel_layout and
+        panel_rotate for chains that are not simply stacked.
         """
 
-        rows, cols = self.rows, self.cols
-        p_rows, p_cols = self.p_rows, self.p_cols
+        transpose, size, ops = self.get_panel_map()
+        if transpose is not None:
+            image = image.transpose(transpose)
 
-        if rows * cols != p_rows * p_cols:
-            rows -= rows % p_rows
-            cols -= p_cols % cols
+        img = Image.new("RGB", (self.p_cols, self.p_rows), "black")
+        for box, dest, flip in ops:
+            tile = image.crop(box)
+            if flip:
+                tile = tile.transpose(Image.ROTATE_180)
+            img.paste(tile, dest)
+        return img
 
-        img = Image.new("RGB", (p_cols, p_rows), "black")
-        orig_data = list(image.getdata())
+    def needs_shaping(self, frame):
+        if self.disc:
+            # a list of pixels is already specifically for the disc
+            return type(frame[0]) != list
+        if type(frame[0]) == list:
+            return False
+        return self.decompose or self.rescale()
 
-        n_panels = int(rows / p_rows)
-        if n_panels == 1:
-            img.putdata(orig_data)
-            return img
+    def shape_settings(self):
+        """
+        Everything that changes what shaping produces. The shape cache is
+        emptied whenever any of it changes.
+        """
+        return (
+            self.disc,
+            self.disc_sample,
+            self.disc_sample_radius,
+            self.decompose,
+            self.mock,
+            self.rows,
+            self.cols,
+            self.p_rows,
+            self.p_cols,
+            self.panel_cols,
+            self.panel_layout,
+            self.panel_rotate,
+            self.main and (self.main.cols, self.main.rows),
+        )
+
+    def rescale(self):
+        """
+        True for an extra display (see fanout.py) of a different size from
+        the main one, which the frames are rendered for.
+        """
+        return self.main is not None and (self.main.cols, self.main.rows) != (self.cols, self.rows)
 
-        img_data = []
-        for row in range(0, p_rows):
-            for panel_no in range(0, n_panels):
-                r = row * cols + cols * p_rows * panel_no
-                img_data.extend(orig_data[r:r+cols])
-        img.putdata(img_data[:p_cols*p_rows])
-        return img
+    def shape_image(self, image):
+        if self.disc:
+            return self._disc.sample_image(image, radius=self.disc_sample_radius, kernel=self.disc_sample)
+        if self.rescale():
+            # frames are made for the main display: put this one where it
+            # would go there, then letterbox that to fit this display
+            size = (self.main.cols, self.main.rows)
+            if image.size != size:
+                canvas = Image.new("RGB", size, "black")
+                canvas.paste(image, (0, 0))
+                image = canvas
+            image = ImageOps.pad(image.convert("RGB"), (self.cols, self.rows), color="black")
+        if self.decompose:
+            return self.reshape(image)
+        return image
+
+    def shaped(self, image):
+        """
+        Return image shaped for the display, from the shape cache if we can.
+
+        The cache is keyed by the identity of the source image and holds
+        only a weak reference to it, so entries cost nothing but the shaped
+        output, which is what shape_cache_mb limits. ImageControllers hand
+        out the same Image objects every time an animation loops, so a
+        looping GIF is shaped once. When a source is freed its entry is
+        dropped, so single-use frames, like those of generated animations,
+        do not push out the ones that are shown again. Otherwise the least
+        recently used entries are dropped to stay under shape_cache_mb.
+        """
+        key = self.shape_settings()
+        with self.shape_lock:
+            self.purge_shape_cache()
+            if key != self.shape_cache_key:
+                self.shape_cache.clear()
+                self.shape_cache_bytes = 0
+                self.shape_cache_key = key
+            entry = self.shape_cache.get(id(image))
+            if entry and entry[0]() is image:
+                self.shape_cache.move_to_end(id(image))
+                return entry[1]
+
+        shaped = self.shape_image(image)
+        if type(shaped) == list:
+            size = len(shaped) * 64
+        else:
+            size = shaped.width * shaped.height * 3
+        max_bytes = self.shape_cache_mb * 1024 * 1024
+
+        with self.shape_lock:
+            if key == self.shape_cache_key and size <= max_bytes:
+                old = self.shape_cache.pop(id(image), None)
+                if old:
+                    self.shape_cache_bytes -= old[2]
+                # the callback runs wherever the image is freed, so it only queues
+                ref = weakref.ref(image, lambda ref, key=id(image): self.shape_dead.append((key, ref)))
+                self.shape_cache[id(image)] = (ref, shaped, size)
+                self.shape_cache_bytes += size
+                while self.shape_cache_bytes > max_bytes:
+                    _, old = self.shape_cache.popitem(last=False)
+                    self.shape_cache_bytes -= old[2]
+        return shaped
+
+    def purge_shape_cache(self):
+        """
+        Drop the entries of sources that have been freed. Called with
+        shape_lock held.
+        """
+        while self.shape_dead:
+            key, ref = self.shape_dead.pop()
+            entry = self.shape_cache.get(key)
+            # the id may already belong to a newer image
+            if entry and entry[0] is ref:
+                del self.shape_cache[key]
+                self.shape_cache_bytes -= entry[2]
+
+    def shape_ahead(self, frames):
+        """
+        Shape frames into the cache before they are dequeued, so that
+        render() only has to push pixels. Called by ImageControllers
+        right after transform().
+        """
+        for frame in frames:
+            if not self.go:
+                return
+            if self.needs_shaping(frame):
+                self.shaped(frame[0])
 
     def shape_one_for_display(self, frame):
         """
@@ -153,27 +387,15 @@ class MatrixController(Base):
             such as rendering for the dotstar disc or a chain of
             LED matrix panels.
 
-            Consider some kind of cache for this.
-
-            Doing this in real time for a decomposed matrix is fine, with
-            a fast enough pi. On the pi zero I use to run my Dotstar disc,
-            doing the sampling in real time will be very slow. Caching may
-            be enough for a repeating animation, but it will not help for
-            a continuously generated visualization.
+            Shaped images are cached (see shaped()), so a repeating
+            animation is sampled or reshaped once rather than every
+            time a frame comes up. That matters on the pi zero that
+            runs my Dotstar disc. A continuously generated
+            visualization still pays for every frame.
         """
-        if self.disc:
-            if type(frame[0]) == list:
-                # if the frame is already a list of pixels specifically
-                # for the disc, just keep it.
-                return frame
-            return (self._disc.sample_image(frame[0]), frame[1])
-        else:
-            if self.decompose:
-                if self.mock:
-                    return frame
-                else:
-                    return (self.reshape(frame[0]), frame[1])
+        if not self.needs_shaping(frame):
             return frame
+        return (self.shaped(frame[0]), frame[1])
 
     def shape_for_display(self, frames):
         if self.disc:
@@ -195,62 +417,124 @@ class MatrixController(Base):
             self.db("setting disc image")
             return self._disc.set_image(image)
 
+        if type(image) == list:
+            # pixels for a disc, nothing a matrix can show
+            return
+
         self.db("setting matrix image")
-        self.matrix.SetImage(image)
+        self.draw_offscreen(frame)
+        self.swap()
 
-    def render(self):
-        self.db("render()")
+    def uses_canvas(self):
+        return self.canvas is not None and not self.disc and not self.nodisplay
 
-        # If we have a frame update pending, cancel it
-        if self.timer:
-            self.timer.cancel()
-            self.timer = None
+    def draw_offscreen(self, frame):
+        """
+        Convert frame into the offscreen canvas, ready for swap().
+        """
+        self.canvas.SetImage(frame[0])
+
+    def swap(self):
+        """
+        Show the offscreen canvas at the next vsync. The canvas that was
+        on screen comes back to be drawn into next.
+        """
+        self.canvas = self.matrix.SwapOnVSync(self.canvas)
 
-        # self.show() sets self.go to true, but hawks.show() will set it to false so
-        # that we stop spending time drawing animations while it renders new frames.
-        # Also used by hawks.show() to make this ImageController exit so a new one
-        # can be the only thing writing to the frame queue.
-        if not self.go:
+    def prepare_next(self):
+        """
+        Take the next frame off the queue and draw it into the offscreen
+        canvas now, so that render() only has to swap it in when it is due.
+        """
+        if not self.uses_canvas() or self.frame_queue.empty():
             return
+        source = self.frame_queue.get()
+        frame = self.shape_one_for_display(source)
+        if type(frame[0]) != list:
+            self.draw_offscreen(frame)
+        self.pending = frame
+        self.pending_source = source
 
-        # draw this frame on the hardware thingy (or the mock)
-        if self.frame and self.frame_queue.empty():
-            # we were showing something and have nothing: leave it up for another duration ms
-            pass
-        elif not self.frame_queue.empty():
-            # it's time for a new one and there's something in the queue. get it.
-            self.frame = self.shape_one_for_display(self.frame_queue.get())
-        if not self.frame:
-            # if it's time for a new frame and we don't have one at all,
-            # blank for 100ms, then try again
-            self.frame=(self.blank, 100)
-
-        self.SetFrame(self.frame)
-
-        duration = self.frame[1]
-
-        if duration:
-            # duration is in ms
-            self.next_time = self.next_time + duration / 1000.0
-            frame_interval = self.next_time - time.time()
-            self.timer = Timer(frame_interval, self.render)
-            self.timer.start()
+    def render(self):
+        self.db("render()")
 
-    def show(self):
+        with self.render_lock:
+            # If we have a frame update pending, cancel it
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+            # self.show() sets self.go to true, but hawks.show() will set it to false so
+            # that we stop spending time drawing animations while it renders new frames.
+            # Also used by hawks.show() to make this ImageController exit so a new one
+            # can be the only thing writing to the frame queue.
+            if not self.go:
+                return
+
+            # draw this frame on the hardware thingy (or the mock)
+            if self.pending:
+                # drawn into the offscreen canvas ahead of time, just swap it in
+                self.frame = self.pending
+                source = self.pending_source
+                self.pending = None
+                if type(self.frame[0]) != list:
+                    self.swap()
+            else:
+                source = self.frame_source
+                if self.frame and self.frame_queue.empty():
+                    # we were showing something and have nothing: leave it up for another duration ms
+                    pass
+                elif not self.frame_queue.empty():
+                    # it's time for a new one and there's something in the queue. get it.
+                    source = self.frame_queue.get()
+                    self.frame = self.shape_one_for_display(source)
+                if not self.frame:
+                    # if it's time for a new frame and we don't have one at all,
+                    # blank for 100ms, then try again
+                    self.frame=(self.blank, 100)
+                    source = self.frame
+
+                self.SetFrame(self.frame)
+
+            if self.preview and source is not self.frame_source:
+                # on the disc, the pixels the LEDs were given, not the image they were sampled from
+                self.preview.publish(self.frame[0] if self.disc else source[0], self._disc)
+            self.frame_source = source
+
+            duration = self.frame[1]
+
+            if duration:
+                # duration is in ms
+                self.next_time = self.next_time + duration / 1000.0
+                frame_interval = self.next_time - time.time()
+                self.timer = Timer(frame_interval, self.render)
+                self.timer.start()
+                self.prepare_next()
+
+    def show(self, start_time=None):
         """
         This is called every time something changes, like run_sign starting or
         a settings change via the API.  This is what the API calls to ensure
         that the changes it just set are acted upon.
+
+        start_time, if given, is when to show the first frame. Displays
+        given the same start_time stay in step, see fanout.py.
         """
 
         self.db(f"show()")
 
         self.db("transforming frames")
 
-        self.next_time = time.time()
+        self.next_time = start_time or time.time()
         self.frame = None
+        self.pending = None
         self.go = True
-        self.render()
+        delay = self.next_time - time.time()
+        if delay > 0:
+            self.timer = Timer(delay, self.render)
+            self.timer.start()
+        else:
+            self.render()
 
     def stop(self):
         """
@@ -259,6 +543,7 @@ class MatrixController(Base):
         self.go = False
         if getattr(self, "timer", None):
             self.timer.cancel()
+        self.pending = None
 
     def start(self):
         """
@@ -1,54 +1,180 @@
 #!/usr/bin/env python3
 
 import sys
+import time
 from PIL import Image
-from sample import generate_offsets
+from threading import Lock, Timer
+
+
+class TerminalRenderer(object):
+    """
+    Draws images in a 24-bit color terminal, two pixel rows per character
+    cell: an upper half block in the top pixel's color over the bottom
+    pixel's color as background. Only the cells that changed since the
+    last frame are written, colors are only sent when they change along a
+    run, and frames arriving faster than max_fps are coalesced, so the
+    newest one is drawn when the interval is up.
+    """
+
+    def __init__(self, max_fps=30, stream=None):
+        self.max_fps = max_fps
+        self.stream = stream or sys.stdout
+        self.cells = None
+        self.size = None
+        self.last_draw = 0
+        self.waiting = None
+        self.timer = None
+        self.lock = Lock()
+
+    def draw(self, image):
+        with self.lock:
+            if self.max_fps:
+                wait = self.last_draw + 1.0 / self.max_fps - time.time()
+                if wait > 0:
+                    self.waiting = image
+                    if not self.timer:
+                        self.timer = Timer(wait, self.draw_waiting)
+                        self.timer.daemon = True
+                        self.timer.start()
+                    return
+            self.waiting = None
+            self.write(image)
+
+    def draw_waiting(self):
+        with self.lock:
+            self.timer = None
+            image = self.waiting
+            self.waiting = None
+            if image is not None:
+                self.write(image)
+
+    def write(self, image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        width, height = image.size
+        values = iter(image.tobytes())
+        pixels = list(zip(values, values, values))
+        if height % 2:
+            pixels.extend([(0, 0, 0)] * width)
+        cells = [
+            (pixels[y * width + x], pixels[(y + 1) * width + x])
+            for y in range(0, height, 2)
+            for x in range(width)
+        ]
+
+        output = []
+        previous = self.cells
+        if image.size != self.size or previous is None:
+            output.append("\033[2J")
+            previous = [None] * len(cells)
+        fg = bg = None
+        cursor = None
+        for idx, cell in enumerate(cells):
+            if cell == previous[idx]:
+                continue
+            if cursor != idx:
+                output.append(f"\033[{idx // width + 2};{idx % width + 1}H")
+            top, bottom = cell
+            if top != fg:
+                output.append("\033[38;2;{};{};{}m".format(*top))
+                fg = top
+            if bottom != bg:
+                output.append("\033[48;2;{};{};{}m".format(*bottom))
+                bg = bottom
+            output.append("\u2580")
+            cursor = idx + 1
+            if cursor % width == 0:
+                cursor = None
+        if output:
+            output.append(f"\033[0m\033[{(height + 1) // 2 + 2};1H")
+            self.stream.write("".join(output))
+            self.stream.flush()
+
+        self.cells = cells
+        self.size = image.size
+        self.last_draw = time.time()
+
+
+class FrameCanvas(object):
+    """
+    Stands in for rgbmatrix's FrameCanvas, an offscreen buffer that
+    RGBMatrix.SwapOnVSync() puts on the display.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.image = None
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        self.image = image
+
+    def Clear(self):
+        self.image = None
+
 
 class RGBMatrix(object):
     def __init__(self, *args, **kwargs):
         for k, v in kwargs.items():
             setattr(self, k, v)
-        self.clear_image = Image.new("RGB", (self.options.cols, self.options.rows), (0, 0, 0, 0))
+        self.panel_map = getattr(self.options, "panel_map", None)
+        width = self.options.cols * getattr(self.options, "chain_length", 1)
+        self.clear_image = Image.new("RGB", (width, self.options.rows), (0, 0, 0, 0))
         self.frame = None
         self.image = None
+        self.front = None
+        self.renderer = TerminalRenderer(max_fps=getattr(self.options, "mock_fps", 30))
 
-    def text_as_color(self, text, rgb):
+    def unmap(self, image):
         """
-        Return string with text prefixed by ANSI escape
-        code to set the backgorund to the color specified
-        by "rgb" (a tuple of r, g, b bytes).  The string
-        also include the escape sequence to set the terminal
-        back to its default colors.
+        Put a panel chain image back together the way the panels are laid
+        out, undoing MatrixController.reshape(), so the mock shows what the
+        physical display would.
         """
-        escape_seq = "\033[48;2;{0};{1};{2}m{3}\033[10;m"
-        return escape_seq.format(*rgb[0:3], text)
+        transpose, size, ops = self.panel_map
+        physical = Image.new("RGB", size, "black")
+        for box, dest, flip in ops:
+            tile = image.crop((dest[0], dest[1], dest[0] + box[2] - box[0], dest[1] + box[3] - box[1]))
+            if flip:
+                tile = tile.transpose(Image.ROTATE_180)
+            physical.paste(tile, box[0:2])
+        if transpose == Image.ROTATE_90:
+            physical = physical.transpose(Image.ROTATE_270)
+        elif transpose == Image.ROTATE_270:
+            physical = physical.transpose(Image.ROTATE_90)
+        elif transpose is not None:
+            physical = physical.transpose(transpose)
+        return physical
 
     def print_image(self, image, cols=None):
         if image is self.image and self.frame:
             return
-        count = 0
-        output = []
-        output.append("\033[2J\033[H")
-        output.append("\n")
-        data = image.getdata()
-
-        if cols is None:
-            cols = self.options.cols
-            if cols == 4 * self.options.rows:
-                cols /= 2
-
-        for px in data:
-            output.append(self.text_as_color("  ", px))
-            count += 1
-            if count % cols == 0:
-                output.append("\n")
-        output.append("\n")
-
+        if cols and cols != image.width:
+            image = Image.frombytes("RGB", (int(cols), int(image.width * image.height / cols)), image.tobytes())
         self.image = image
-        self.frame = "".join(output)
-        sys.stdout.write(self.frame)
+        self.frame = True
+        self.renderer.draw(image)
+
+    def CreateFrameCanvas(self):
+        return FrameCanvas(self.clear_image.width, self.clear_image.height)
+
+    def SwapOnVSync(self, canvas, framerate_fraction=1):
+        """
+        Display canvas and hand back the one it replaces, as rgbmatrix does.
+        """
+        previous = self.front or self.CreateFrameCanvas()
+        self.front = canvas
+        self.SetImage(canvas.image or self.clear_image)
+        return previous
 
     def SetImage(self, image, *args, **kwargs):
+        if self.panel_map:
+            if image is self.image and self.frame:
+                return
+            physical = self.unmap(image)
+            self.print_image(physical, cols=physical.width)
+            self.image = image
+            return
         self.print_image(image)
 
     def Clear(self):
@@ -67,21 +193,45 @@ class board(object):
 
 class adafruit_dotstar(object):
     class DotStar(object):
-        def __init__(self, sck, mosi, num_pixels, auto_write=True, disc=None):
-            self.dots = list((0, 0, 0, 0) * 255)
+        """
+        Stands in for adafruit_dotstar.DotStar. Supports the same item and
+        slice assignment, fill() and show(), and draws the disc in the
+        terminal on show(). show_count counts the writes that would have
+        gone out over SPI.
+        """
+
+        def __init__(self, sck, mosi, num_pixels, auto_write=True, disc=None, mock_fps=30):
+            self.n = num_pixels
+            self.dots = [(0, 0, 0)] * num_pixels
             self.disc = disc
+            self.auto_write = auto_write
+            self.show_count = 0
+            self.buffer = bytearray(64 * 64 * 3)
+            self.renderer = TerminalRenderer(max_fps=mock_fps)
+
+        def __len__(self):
+            return self.n
+
+        def __getitem__(self, idx):
+            return self.dots[idx]
+
         def __setitem__(self, idx, value):
+            if isinstance(idx, slice):
+                value = list(value)
+                if len(range(*idx.indices(self.n))) != len(value):
+                    raise ValueError("Slice and input sequence size do not match.")
             self.dots[idx] = value
-        def show(self):
-            pixels = self.disc.get_pixels((64, 64))
-            image = Image.new("RGB", (64, 64), (0, 0, 0, 0))
-            data = list(image.getdata())
-            for idx, pixel in enumerate(pixels):
-                data[pixel[0] + 64 * pixel[1]] = self.dots[idx]
-            image.putdata(data)
-            options = RGBMatrixOptions()
-            setattr(options, "cols", 64)
-            setattr(options, "rows", 64)
-            matrix = RGBMatrix(options=options)
-            matrix.print_image(image)
+            if self.auto_write:
+                self.show()
+
+        def fill(self, color):
+            self.dots = [color] * self.n
+            if self.auto_write:
+                self.show()
 
+        def show(self):
+            self.show_count += 1
+            buffer = self.buffer
+            for dot, offset in zip(self.dots, self.disc.index_map((64, 64))):
+                buffer[offset * 3 : offset * 3 + 3] = bytes(int(c) for c in dot[0:3])
+            self.renderer.draw(Image.frombytes("RGB", (64, 64), bytes(buffer)))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+Polar frames and effects for the DotStar disc.
+
+A PolarFrame holds one list of colors per ring of the disc, in the same
+order as Disc.circles, so it flattens straight into the 255-element list
+that Disc.set_image() writes without sampling. Effects work on rings and
+angular positions rather than on a rectilinear image:
+
+    rotate()            shifts each ring by the number of pixels closest to
+                        the angle, no resampling
+    radial_gradient()   blends two colors from the center out
+    ripple()            rings of brightness moving out from the center
+    spiral()            a palette wound around the disc
+
+The geometry (radius and angle of every pixel) is computed once, and the
+effects only index into precomputed palettes, so they are cheap enough
+for a Pi Zero to run at full frame rate.
+"""
+
+import math
+from disc import Disc
+
+
+class Ring(object):
+    def __init__(self, radius, count):
+        self.radius = radius
+        self.count = count
+        self.angles = [360.0 * n / count for n in range(count)]
+
+
+RINGS = [Ring(radius, count) for (radius, count) in Disc.circles]
+MAX_RADIUS = max(ring.radius for ring in RINGS)
+
+
+class PolarFrame(object):
+    """
+    One color per disc pixel, grouped by ring. rings[0] is the outermost
+    ring, matching the pixel order of the disc.
+    """
+
+    def __init__(self, rings=None, color=(0, 0, 0)):
+        if rings is None:
+            rings = [[color] * ring.count for ring in RINGS]
+        self.rings = rings
+
+    def copy(self):
+        return PolarFrame([list(ring) for ring in self.rings])
+
+    def pixels(self):
+        """
+        Flatten to the list of 255 colors that Disc.set_image() expects.
+        """
+        pixels = []
+        for ring in self.rings:
+            pixels.extend(ring)
+        return pixels
+
+    def rotate(self, degrees):
+        """
+        Return a new frame rotated by degrees. Each ring is shifted by the
+        whole number of pixels nearest to the angle, so rings with fewer
+        pixels move in coarser steps.
+        """
+        rings = []
+        for ring, pixels in zip(RINGS, self.rings):
+            shift = int(round(degrees * ring.count / 360.0)) % ring.count
+            if shift:
+                pixels = pixels[-shift:] + pixels[:-shift]
+            rings.append(pixels)
+        return PolarFrame(rings)
+
+    def map(self, func):
+        """
+        Return a new frame with func(ring, position, color) applied to every pixel.
+        """
+        return PolarFrame(
+            [[func(ring, n, color) for n, color in enumerate(pixels)] for ring, pixels in zip(RINGS, self.rings)]
+        )
+
+
+def blend(one, two, amount):
+    return tuple(int(a + (b - a) * amount) for a, b in zip(one, two))
+
+
+def scale(color, amount):
+    return tuple(int(c * amount) for c in color)
+
+
+def radial_gradient(inner, outer):
+    """
+    A frame blending from inner at the center to outer at the edge.
+    """
+    return PolarFrame([[blend(inner, outer, ring.radius / MAX_RADIUS)] * ring.count for ring in RINGS])
+
+
+def ripple(color, phase, wavelength=2.0, background=(0, 0, 0)):
+    """
+    A frame of concentric waves of color over background. phase runs from
+    0 to 1 and moves the waves out by one wavelength (in disc radius units).
+    """
+    rings = []
+    for ring in RINGS:
+        amount = (math.sin(2 * math.pi * (ring.radius / wavelength - phase)) + 1) / 2
+        rings.append([blend(background, color, amount)] * ring.count)
+    return PolarFrame(rings)
+
+
+def spiral(palette, phase, arms=1, twist=0.5):
+    """
+    A frame with palette wound around the disc in arms spiral arms. twist is
+    the number of turns from the center to the edge, phase from 0 to 1
+    turns the spiral once around.
+    """
+    size = len(palette)
+    rings = []
+    for ring in RINGS:
+        offset = ring.radius / MAX_RADIUS * twist + phase
+        rings.append([palette[int((arms * angle / 360.0 + offset) * size) % size] for angle in ring.angles])
+    return PolarFrame(rings)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""
+Bulk pre-rendering of a slideshow directory.
+
+Loading, filtering and transforming an image is the expensive part of
+showing a slide. prerender_directory() does that work for every file in
+slideshow_directory in a pool of processes, one per core, and stores the
+transformed frames in a RenderCache. SlideshowImageController checks the
+cache before loading a file, so the first pass through a freshly copied
+directory is as smooth as every pass after it.
+
+Cache entries are keyed by the file's path, mtime and size, and by every
+setting that changes what transform() produces, so changing the panel
+settings simply misses the cache until the directory is pre-rendered again.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import time
+from base import Base
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+from settings import Settings
+from threading import Lock
+
+
+RENDER_SETTINGS = [
+    "rows",
+    "cols",
+    "underscan",
+    "disc",
+    "zoom",
+    "zoom_level",
+    "zoom_center",
+    "x",
+    "y",
+    "fit",
+    "transpose",
+    "rotate",
+    "brightness",
+    "filter",
+    "animate_gifs",
+    "gif_frame_no",
+    "gif_speed",
+    "gif_loop_delay",
+    "no_gif_override_duration_zero",
+]
+
+
+class RenderCache(Base):
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, path, settings):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        signature = [os.path.abspath(path), st.st_mtime, st.st_size]
+        signature.extend(getattr(settings, name, None) for name in RENDER_SETTINGS)
+        return hashlib.sha1(json.dumps(signature).encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ".frames")
+
+    def pack(self, frames):
+        return [(image.mode, image.size, image.tobytes(), duration) for image, duration in frames]
+
+    def unpack(self, packed):
+        return [(Image.frombytes(mode, size, data), duration) for mode, size, data, duration in packed]
+
+    def get(self, path, settings):
+        """
+        Return (static_frames, bright_frames) for path rendered with settings,
+        or None if it has not been pre-rendered.
+        """
+        key = self.key(path, settings)
+        if not key:
+            return None
+        try:
+            with open(self.entry_path(key), "rb") as ENTRY:
+                static, bright = pickle.load(ENTRY)
+            os.utime(self.entry_path(key))
+        except (OSError, pickle.PickleError, EOFError, ValueError):
+            return None
+        return self.unpack(static), self.unpack(bright)
+
+    def put(self, path, settings, static_frames, bright_frames):
+        key = self.key(path, settings)
+        if not key:
+            return
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path + ".tmp", "wb") as ENTRY:
+                pickle.dump((self.pack(static_frames), self.pack(bright_frames)), ENTRY)
+            os.replace(entry_path + ".tmp", entry_path)
+        except OSError as e:
+            self.db(f"Unable to cache {path}: {e}")
+
+    def contains(self, path, settings):
+        key = self.key(path, settings)
+        return bool(key) and os.path.exists(self.entry_path(key))
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".frames"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for used, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+caches = {}
+caches_lock = Lock()
+
+
+def get_cache(directory, **kwargs):
+    with caches_lock:
+        cache = caches.get(directory)
+        if cache is None:
+            cache = caches[directory] = RenderCache(directory, **kwargs)
+        for k, v in kwargs.items():
+            setattr(cache, k, v)
+        return cache
+
+
+def prerender_one(path, values):
+    """
+    Runs in a worker process. Load, filter and transform one file with the
+    given settings values and store the result in the render cache.
+    Returns (path, ok).
+    """
+    # imported here, imagecontroller imports this module
+    from imagecontroller import FileImageController
+
+    settings = Settings(**values)
+    settings.hawks = None
+    settings.internal.add("hawks")
+    settings.set("filename", path)
+    ctrl = FileImageController(settings)
+    frames = ctrl.render()
+    if not frames:
+        return path, False
+    if ctrl.filter and ctrl.filter != "none":
+        frames = getattr(ctrl, "filter_" + ctrl.filter)(frames)
+    static_frames, bright_frames = ctrl.transform(frames)
+    get_cache(values["render_cache_dir"]).put(path, settings, static_frames, bright_frames)
+    return path, True
+
+
+def prerender_directory(settings, progress=None, workers=None):
+    """
+    Pre-render every file in settings.slideshow_directory that is not already
+    in the render cache. progress, if given, is called with a dict of
+    total, done, failed and elapsed after every file.
+    """
+    import assetindex
+
+    cache = get_cache(settings.render_cache_dir, max_bytes=settings.render_cache_mb * 1024 * 1024)
+    index = assetindex.get_index(settings.slideshow_directory)
+    paths = [
+        os.path.join(settings.slideshow_directory, relpath)
+        for relpath in index.paths(recursive=settings.slideshow_recursive)
+    ]
+    paths = [path for path in paths if not cache.contains(path, settings)]
+    values = dict(settings.list())
+
+    status = {"total": len(paths), "done": 0, "failed": 0, "elapsed": 0.0}
+    started = time.time()
+    if progress:
+        progress(dict(status))
+    if paths:
+        # forkserver, not fork: forking this process, threads and all, can leave a
+        # worker holding a lock that some other thread had at the time
+        context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as executor:
+            futures = [executor.submit(prerender_one, path, values) for path in paths]
+            for future in as_completed(futures):
+                try:
+                    path, ok = future.result()
+                except Exception as e:
+                    print(f"Unable to pre-render: {e}")
+                    ok = False
+                status["done"] += 1
+                if not ok:
+                    status["failed"] += 1
+                status["elapsed"] = time.time() - started
+                if progress:
+                    progress(dict(status))
+    cache.evict()
+    status["elapsed"] = time.time() - started
+    return status
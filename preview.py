@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Live preview of the frames the display is actually showing.
+
+MatrixController publishes every new frame it puts up. Publishing only
+stores a reference, so it costs the render loop nothing when nobody is
+watching. While at least one client is connected, one encoder thread
+turns the latest frame into a JPEG, at most preview_fps times a second,
+and every client is handed the same bytes. A second viewer costs a
+socket write per frame, not an encode.
+
+/api/do/stream serves it as multipart/x-mixed-replace (MJPEG), which an
+<img> tag plays directly.
+"""
+
+import io
+import time
+from base import Base
+from threading import Condition, Thread
+
+
+class PreviewBusy(Exception):
+    pass
+
+
+class PreviewStream(Base):
+    boundary = "hawksframe"
+
+    def __init__(self, settings):
+        super().__init__()
+        self.settings = settings
+        self.cond = Condition()
+        # (seq, image, disc) of the newest frame shown, replaced in one assignment
+        self.latest = (0, None, None)
+        self.jpeg = None
+        self.jpeg_seq = 0
+        self.clients = 0
+        self.thread = None
+
+    def publish(self, image, disc=None):
+        """
+        Called by MatrixController with each new frame it shows. image may
+        be a list of disc pixels, in which case disc is the Disc to draw
+        them with.
+        """
+        self.latest = (self.latest[0] + 1, image, disc)
+        if self.clients:
+            with self.cond:
+                self.cond.notify_all()
+
+    def make_jpeg(self, image, disc):
+        if isinstance(image, list):
+            image = disc.pixels_image(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        with io.BytesIO() as output:
+            # no chroma subsampling, LED art is all hard color edges
+            image.save(output, format="JPEG", quality=90, subsampling=0)
+            return output.getvalue()
+
+    def encode(self):
+        """
+        Encoder thread, runs while there are clients.
+        """
+        last = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: not self.clients or self.latest[0] != last, timeout=1)
+                if not self.clients:
+                    self.thread = None
+                    return
+                seq, image, disc = self.latest
+            if seq == last or image is None:
+                continue
+            last = seq
+            try:
+                jpeg = self.make_jpeg(image, disc)
+            except Exception as e:
+                self.db(f"Unable to encode preview: {e}")
+                continue
+            with self.cond:
+                self.jpeg = jpeg
+                self.jpeg_seq += 1
+                self.cond.notify_all()
+            time.sleep(1.0 / max(1, self.settings.preview_fps))
+
+    def frames(self, keepalive_sec=5):
+        """
+        Generator of JPEG frames for one client. Yields the current frame
+        straight away, then each new one, repeating the last one every
+        keepalive_sec while the display is still. Raises PreviewBusy if
+        preview_max_clients are already connected.
+        """
+        with self.cond:
+            if self.clients >= self.settings.preview_max_clients:
+                raise PreviewBusy(f"{self.clients} preview clients already connected")
+            self.clients += 1
+            if self.thread is None:
+                self.thread = Thread(target=self.encode, daemon=True)
+                self.thread.start()
+        try:
+            seq = 0
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.jpeg_seq != seq, timeout=keepalive_sec)
+                    jpeg, seq = self.jpeg, self.jpeg_seq
+                if jpeg:
+                    yield jpeg
+        finally:
+            with self.cond:
+                self.clients -= 1
+                self.cond.notify_all()
+
+    def part(self, jpeg):
+        return (
+            f"--{self.boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n".encode("latin-1")
+            + jpeg
+            + b"\r\n"
+        )
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 import math
-from PIL import Image
+from operator import itemgetter
+from PIL import Image, ImageFilter
 
 
 def sample_at_position(img_data, size, position, offsets):
@@ -69,6 +70,115 @@ def generate_offsets(shape, size):
     return set()
 
 
+class Sampler(object):
+    """
+    A compiled sampling of an image of one size at a fixed list of positions.
+
+    The averaging is done by a PIL filter over the whole image, in C, and the
+    averaged pixels are then gathered from the image bytes by a single
+    itemgetter over precomputed byte offsets.
+
+    kernel is one of:
+        circle      mean of the pixels within radius (the original sampling)
+        box         mean of the (2 * radius + 1) square, area weighted
+        gaussian    gaussian weighted, radius is the standard deviation
+
+    PIL does not filter pixels within radius of the image edge for a circle
+    kernel, and has no circle kernel larger than 5x5. Those positions get an
+    explicit list of taps instead, averaged in Python over the taps that fall
+    inside the image, exactly as sample() does. For a circle of radius 3 or
+    more that is every position, so the cost grows with the area of the
+    circle and the speedup over sample() falls from about 6x at radius 1 to
+    under 2x at radius 3. box and gaussian stay in C at any radius.
+
+    Filtered values are rounded by PIL where sample() truncates, so a channel
+    can come out 1 higher than sample() gives for the same position.
+    """
+
+    def __init__(self, size, positions, kernel="circle", radius=1):
+        cols, rows = size
+        self.size = tuple(size)
+        self.filter = None
+        self.taps = []
+
+        exact = []
+        if radius > 0:
+            if kernel == "box":
+                self.filter = ImageFilter.BoxBlur(radius)
+            elif kernel == "gaussian":
+                self.filter = ImageFilter.GaussianBlur(radius)
+            else:
+                offsets = generate_circle_offsets(radius)
+                if radius <= 2:
+                    width = 2 * radius + 1
+                    weights = [0] * (width * width)
+                    for (dx, dy) in offsets:
+                        weights[(dy + radius) * width + dx + radius] = 1
+                    self.filter = ImageFilter.Kernel((width, width), weights, scale=len(offsets))
+                    margin = radius
+                else:
+                    margin = max(cols, rows)
+                for idx, (x, y) in enumerate(positions):
+                    if x < margin or y < margin or x >= cols - margin or y >= rows - margin:
+                        exact.append((idx, x, y))
+
+        offsets = []
+        for (x, y) in positions:
+            base = (y * cols + x) * 3
+            offsets.extend((base, base + 1, base + 2))
+        self.gather = itemgetter(*offsets)
+
+        if exact:
+            circle = generate_circle_offsets(radius)
+            for (idx, x, y) in exact:
+                taps = [
+                    ((sy * cols + sx) * 3)
+                    for (sx, sy) in ((x + dx, y + dy) for (dx, dy) in circle)
+                    if 0 <= sx < cols and 0 <= sy < rows
+                ]
+                self.taps.append((idx, taps))
+
+    def __call__(self, image):
+        """
+        Return a list of (r, g, b) tuples, one per position.
+        """
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        data = image.tobytes()
+        if self.filter:
+            filtered = image.filter(self.filter).tobytes()
+        else:
+            filtered = data
+        values = iter(self.gather(filtered))
+        pixels = list(zip(values, values, values))
+        for (idx, taps) in self.taps:
+            count = len(taps)
+            if count:
+                pixels[idx] = (
+                    sum(data[o] for o in taps) // count,
+                    sum(data[o + 1] for o in taps) // count,
+                    sum(data[o + 2] for o in taps) // count,
+                )
+            else:
+                pixels[idx] = (0, 0, 0)
+        return pixels
+
+
+samplers = {}
+
+
+def get_sampler(size, positions, kernel="circle", radius=1):
+    """
+    Samplers are compiled once per (image size, kernel, radius). positions
+    must be the same for a given size, as it is for Disc.coordinate_map().
+    """
+    key = (tuple(size), kernel, radius)
+    sampler = samplers.get(key)
+    if sampler is None:
+        sampler = samplers[key] = Sampler(size, positions, kernel=kernel, radius=radius)
+    return sampler
+
+
 if __name__ == "__main__":
     offsets = generate_offsets("circle", 10)
     visualize_circle_offsets(10, offsets)
@@ -13,7 +13,9 @@ class Settings(Base):
         self.config_file = ".hawks.json"
         self.configs = {}
         self.read_only = set(["configs"])
-        self.internal = set(["helptext", "choices", "internal", "categories", "config_file", "tags", "read_only"])
+        self.internal = set(["helptext", "choices", "internal", "categories", "config_file", "tags", "read_only", "version"])
+        # bumped by every change, so anything derived from the settings can tell when to redo it
+        self.version = 0
 
         for k, v in kwargs.items():
             self.set(k, v)
@@ -92,6 +94,13 @@ class Settings(Base):
             except:
                 pass
         setattr(self, name, value)
+        self.changed()
+
+    def changed(self):
+        """
+        Call after modifying helptext, choices etc. directly. set() calls it.
+        """
+        self.version += 1
 
     def list(self):
         return [
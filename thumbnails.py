@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Small previews of the files in an image directory, for the webui.
+
+Thumbnails are JPEGs in cache_dir, named for the relative path of the file
+and the thumbnail size. Each one is given the mtime of the file it was made
+from, so a thumbnail is current exactly when the two mtimes match, and an
+edited file is simply made again. A background thread makes thumbnails for
+the whole directory when the cache is created, and again for whatever the
+AssetIndex reports as changed, so the webui rarely has to wait for one.
+Thumbnails of files that are removed are removed with them.
+"""
+
+import assetindex
+import hashlib
+import os
+import threading
+from base import Base
+from PIL import Image, UnidentifiedImageError
+from threading import Event, Lock, Thread
+
+
+class ThumbnailCache(Base):
+    def __init__(self, directory, cache_dir=".hawks_thumbnails", size=200):
+        super().__init__()
+        self.index = assetindex.get_index(directory)
+        self.cache_dir = cache_dir
+        self.size = size
+        self.pending = set()
+        self.pending_lock = Lock()
+        self.wanted = Event()
+        self.closed = False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index.add_listener(self.changed)
+        self.changed(self.index, self.index.paths())
+        Thread(target=self.generate_pending, daemon=True).start()
+
+    def thumbnail_path(self, relpath):
+        name = hashlib.sha1(f"{relpath}:{self.size}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name + ".jpg")
+
+    def make(self, relpath, mtime):
+        """
+        Write the thumbnail for relpath. Returns its path, or None if PIL
+        cannot read the file.
+        """
+        path = self.thumbnail_path(relpath)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with Image.open(os.path.join(self.index.directory, relpath)) as image:
+                # JPEGs decode straight to a fraction of their size, much less work than a full decode
+                image.draft("RGB", (self.size, self.size))
+                image = image.convert("RGB")
+            image.thumbnail((self.size, self.size))
+            image.save(tmp, format="JPEG", quality=85)
+            os.utime(tmp, (mtime, mtime))
+            os.replace(tmp, path)
+        except (OSError, UnidentifiedImageError, ValueError) as e:
+            self.db(f"Unable to make thumbnail of {relpath}: {e}")
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return None
+        return path
+
+    def get(self, relpath):
+        """
+        Path of a current thumbnail for relpath, making it if needed. Returns
+        None if relpath is not in the directory or is not an image.
+        """
+        entry = self.index.metadata(relpath)
+        if entry is None or entry["n_frames"] == 0:
+            return None
+        path = self.thumbnail_path(relpath)
+        try:
+            if os.stat(path).st_mtime == entry["mtime"]:
+                return path
+        except OSError:
+            pass
+        return self.make(relpath, entry["mtime"])
+
+    def changed(self, index, relpaths):
+        """
+        AssetIndex listener, called with the index locked, so it only queues.
+        """
+        with self.pending_lock:
+            self.pending.update(relpaths)
+        self.wanted.set()
+
+    def close(self):
+        """
+        Stop listening to the index and stop the background thread.
+        """
+        self.index.remove_listener(self.changed)
+        self.closed = True
+        self.wanted.set()
+
+    def generate_pending(self):
+        """
+        Background thread: bring the thumbnails of changed files up to date.
+        """
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            if self.closed:
+                return
+            with self.pending_lock:
+                relpaths, self.pending = sorted(self.pending), set()
+            for relpath in relpaths:
+                if self.closed:
+                    return
+                if self.index.metadata(relpath) is None:
+                    try:
+                        os.unlink(self.thumbnail_path(relpath))
+                    except OSError:
+                        pass
+                else:
+                    self.get(relpath)
+
+
+caches = {}
+caches_lock = Lock()
+
+
+def get_thumbnails(directory, **kwargs):
+    """
+    ThumbnailCache objects are shared per directory. Asking for one with
+    different settings, such as a new thumbnail_size, closes the old one and
+    makes a new one.
+    """
+    directory = os.path.abspath(directory)
+    with caches_lock:
+        cache, cache_kwargs = caches.get(directory, (None, None))
+        if cache is not None and cache_kwargs != kwargs:
+            cache.close()
+            cache = None
+        if cache is None:
+            cache = ThumbnailCache(directory, **kwargs)
+            caches[directory] = (cache, kwargs)
+        return cache
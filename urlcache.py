@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""
+On-disk, size-bounded cache for images fetched over HTTP.
+
+Each cached URL is stored as two files in the cache directory, named for
+the sha1 of the URL: <key>.body holds the response body and <key>.json holds
+the validators (ETag, Last-Modified) and the time of the last successful
+fetch or revalidation. Entries younger than fresh_sec are served without
+touching the network. Older entries are revalidated with a conditional GET,
+and if the server is slow or unreachable the stale body is served instead.
+
+All outbound HTTP goes through get_session(), one connection-pooled
+requests.Session shared by the whole process.
+"""
+
+import hashlib
+import json
+import os
+import requests
+import requests.adapters
+import time
+from base import Base
+from collections import OrderedDict
+from threading import Lock
+
+
+class UrlCacheException(Exception):
+    pass
+
+
+shared_session = None
+session_lock = Lock()
+
+
+def get_session():
+    global shared_session
+    with session_lock:
+        if shared_session is None:
+            shared_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=8)
+            shared_session.mount("http://", adapter)
+            shared_session.mount("https://", adapter)
+        return shared_session
+
+
+class UrlCache(Base):
+    def __init__(self, directory, max_bytes=32 * 1024 * 1024, fresh_sec=60, timeout=5.0):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fresh_sec = fresh_sec
+        self.timeout = timeout
+        self.lock = Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def paths(self, url):
+        key = self.key(url)
+        return (os.path.join(self.directory, key + ".body"), os.path.join(self.directory, key + ".json"))
+
+    def read_entry(self, url):
+        body_path, meta_path = self.paths(url)
+        try:
+            with open(meta_path, "r") as META:
+                meta = json.load(META)
+            with open(body_path, "rb") as BODY:
+                body = BODY.read()
+        except (OSError, ValueError):
+            return None, None
+        if meta.get("url") != url:
+            return None, None
+        return meta, body
+
+    def write_entry(self, url, meta, body=None):
+        body_path, meta_path = self.paths(url)
+        try:
+            if body is not None:
+                with open(body_path + ".tmp", "wb") as BODY:
+                    BODY.write(body)
+                os.replace(body_path + ".tmp", body_path)
+            with open(meta_path + ".tmp", "w") as META:
+                json.dump(meta, META)
+            os.replace(meta_path + ".tmp", meta_path)
+        except OSError as e:
+            self.db(f"Unable to cache {url}: {e}")
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the bodies fit in max_bytes.
+        Access time is tracked by touching the .json file on every hit.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".body"):
+                continue
+            body_path = os.path.join(self.directory, name)
+            meta_path = body_path[: -len(".body")] + ".json"
+            try:
+                size = os.path.getsize(body_path)
+                used = os.path.getmtime(meta_path)
+            except OSError:
+                used = 0
+                size = 0
+            entries.append((used, size, body_path, meta_path))
+            total += size
+        entries.sort()
+        for used, size, body_path, meta_path in entries:
+            if total <= self.max_bytes:
+                break
+            for path in (body_path, meta_path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def touch(self, url):
+        try:
+            os.utime(self.paths(url)[1])
+        except OSError:
+            pass
+
+    def get(self, url):
+        """
+        Return the body of url, from the cache when we can.
+        Raises UrlCacheException if there is neither a usable response nor a cached copy.
+        """
+        with self.lock:
+            meta, body = self.read_entry(url)
+        now = time.time()
+
+        if meta and now - meta.get("fetched", 0) < self.fresh_sec:
+            self.touch(url)
+            return body
+
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = get_session().get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            if body is not None:
+                self.db(f"Serving stale {url}: {e}")
+                return body
+            raise UrlCacheException(f"Error fetching {url}: {e}")
+
+        if response.status_code == 304 and body is not None:
+            meta["fetched"] = now
+            with self.lock:
+                self.write_entry(url, meta)
+            return body
+
+        if response.status_code != 200:
+            if body is not None:
+                self.db(f"Serving stale {url}: status code {response.status_code}")
+                return body
+            raise UrlCacheException(f"Error fetching {url}: status code {response.status_code}")
+
+        body = response.content
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched": now,
+        }
+        with self.lock:
+            self.write_entry(url, meta, body)
+            self.evict()
+        return body
+
+
+caches = {}
+caches_lock = Lock()
+
+
+def get_cache(directory, **kwargs):
+    """
+    UrlCache objects are shared per directory, so that every
+    URLImageController sees the same lock and the same entries.
+    """
+    with caches_lock:
+        cache = caches.get(directory)
+        if cache is None:
+            cache = caches[directory] = UrlCache(directory, **kwargs)
+        for k, v in kwargs.items():
+            setattr(cache, k, v)
+        return cache
+
+
+class UrlValidator(Base):
+    """
+    Remembers whether a URL answered a HEAD request, for ttl_sec seconds,
+    so that repeated settings changes do not wait on the network. Failures
+    are only remembered for failure_ttl_sec, so a server that was briefly
+    down is retried soon.
+
+    results is kept in the order the URLs were checked, so expired entries
+    are all at the front and are dropped there on each insert. At most
+    max_entries are kept.
+    """
+
+    def __init__(self, ttl_sec=300, failure_ttl_sec=10, timeout=5.0, max_entries=1024):
+        super().__init__()
+        self.ttl_sec = ttl_sec
+        self.failure_ttl_sec = failure_ttl_sec
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.lock = Lock()
+
+    def check(self, url):
+        now = time.time()
+        with self.lock:
+            result = self.results.get(url)
+        if result:
+            valid, checked = result
+            if now - checked < (self.ttl_sec if valid else self.failure_ttl_sec):
+                return valid
+        try:
+            response = get_session().head(url, timeout=self.timeout, allow_redirects=True)
+            valid = response.status_code <= 299
+        except requests.RequestException as e:
+            self.db(f"Unable to validate {url}: {e}")
+            valid = False
+        with self.lock:
+            self.results.pop(url, None)
+            self.results[url] = (valid, now)
+            expired = now - max(self.ttl_sec, self.failure_ttl_sec)
+            while self.results and (
+                len(self.results) > self.max_entries or next(iter(self.results.values()))[1] <= expired
+            ):
+                self.results.popitem(last=False)
+        return valid
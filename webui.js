@@ -0,0 +1,101 @@
+// Behaviour for the Hawks webui page. The page defines hawks_ui, the few
+// settings this needs, so that this file never changes and can be cached.
+
+var update_preview = function(value) {
+    img_tag = document.getElementById("preview")
+    img_tag.src="/thumb/" + encodeURI(value)
+}
+
+var update_url = function(value) {
+    url_field = document.getElementsByName("url")[0]
+    url_field.value = value
+    img_tag = document.getElementById("preview")
+    img_tag.src = value
+}
+
+var add_category_hiders = function(value) {
+    var adv_checkbox = document.getElementById("advanced");
+    var categories = document.getElementsByClassName("category");
+    for (let c = 0; c < categories.length; c++) {
+        window.l.categories[categories[c].title] = true;
+    }
+    for (let n = 0; n < categories.length; n++) {
+
+        let settings_toggler = function() {
+            let cat_title = categories[n].title;
+            if (window.l.categories[cat_title] == false) {
+                window.l.categories[cat_title] = true;
+            } else {
+                window.l.categories[cat_title] = false;
+            }
+            let settings = document.getElementsByClassName(cat_title);
+            for (let s = 0; s < settings.length; s++) {
+                if (window.l.categories[cat_title] == true) {
+                    if (settings[s].classList.contains("advanced")) {
+                        if (adv_checkbox.checked) {
+                            settings[s].style.display = 'table-row';
+                        } else {
+                            settings[s].style.display = 'none';
+                        }
+                    } else {
+                        settings[s].style.display = 'table-row';
+                    }
+                } else {
+                    settings[s].style.display = 'none';
+                }
+            }
+        }
+
+        categories[n].addEventListener('click', settings_toggler);
+        window.l.togglers[categories[n].title] = settings_toggler;
+    }
+
+    let advanced_toggler = function() {
+        var adv_checkbox = document.getElementById("advanced");
+        let settings = document.getElementsByClassName("advanced");
+        for (let s = 0; s < settings.length; s++) {
+            s_cls = settings[s].classList[0];
+            if (window.l.categories[s_cls] == false) {
+                continue;
+            }
+            if (adv_checkbox.checked) {
+                settings[s].style.display = 'table-row';
+            } else {
+                settings[s].style.display = 'none';
+            }
+        }
+    }
+    adv_checkbox.addEventListener('change', advanced_toggler);
+    if (!hawks_ui.advanced) {
+        advanced_toggler();
+    }
+}
+
+var one_mode_only = function(mode) {
+    if (hawks_ui.no_webui_one_mode_only) {
+        return;
+    }
+    var categories = document.getElementsByClassName("category");
+    for (let c = 0; c < categories.length; c++) {
+        if (categories[c].title == "matrix") {
+            continue;
+        }
+        if (categories[c].title == mode) {
+            if (window.l.categories[categories[c].title] == false) {
+                window.l.togglers[categories[c].title]();
+            }
+            continue;
+        }
+        if (window.l.categories[categories[c].title] == true) {
+            window.l.togglers[categories[c].title]();
+        }
+    }
+}
+
+var add_hiders = function(value) {
+    window.l = { categories: { }, togglers: { } };
+    add_category_hiders();
+    one_mode_only(hawks_ui.mode);
+}
+
+window.onload = add_hiders;
@@ -1,136 +1,99 @@
 #!/usr/bin/env python3
 
+import assetindex
+import gzip
+import hashlib
+import json
 import os
 import time
+from threading import Lock
 from urllib.parse import unquote
 
+WEBUI_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "webui.js")
+
 class Webui(object):
     def __init__(self, hawks, api_set):
         self.hawks = hawks
         self.api_set = api_set
+        with open(WEBUI_JS, "rb") as JS:
+            self.js = self.make_page(JS.read().decode("utf-8"))
+        # the rendered page, and the page_version() it was rendered for
+        self.page_lock = Lock()
+        self.page = None
+        self.page_key = None
 
     def webui_form(self, req, message=None):
         if req.command == "POST":
             message = self.webui_submit(req)
+            return self.send_page(req, self.make_page(self.render(message)))
+        version = self.page_version()
+        with self.page_lock:
+            if self.page_key != version:
+                self.page = self.make_page(self.render())
+                self.page_key = version
+            page = self.page
+        return self.send_page(req, page)
+
+    def webui_js(self, req):
+        """
+        /webui.js, which the page asks for as /webui.js?v=<hash>, so it can
+        be cached for good.
+        """
+        self.send_page(req, self.js, content_type="text/javascript; charset=utf-8", cache_control="max-age=31536000, immutable")
+
+    def page_version(self):
+        """
+        Everything the page is rendered from: a change to any setting bumps
+        settings.version, and a change to the img directory bumps the asset
+        index version.
+        """
         filepath = self.hawks.settings.filepath or "img"
-        api_js = f'''
-        var update_preview = function(value) {{
-            img_tag = document.getElementById("preview")
-            img_tag.src="{filepath}/" + value
-        }}
-
-        var update_url = function(value) {{
-            url_field = document.getElementsByName("url")[0]
-            url_field.value = value
-            img_tag = document.getElementById("preview")
-            img_tag.src = value
-        }}
-
-        var add_category_hiders = function(value) {{
-            var adv_checkbox = document.getElementById("advanced");
-            var categories = document.getElementsByClassName("category");
-            for (let c = 0; c < categories.length; c++) {{
-                window.l.categories[categories[c].title] = true;
-            }}
-            for (let n = 0; n < categories.length; n++) {{
-
-                let settings_toggler = function() {{
-                    let cat_title = categories[n].title;
-                    if (window.l.categories[cat_title] == false) {{
-                        window.l.categories[cat_title] = true;
-                    }} else {{
-                        window.l.categories[cat_title] = false;
-                    }}
-                    let settings = document.getElementsByClassName(cat_title);
-                    for (let s = 0; s < settings.length; s++) {{
-                        if (window.l.categories[cat_title] == true) {{
-                            if (settings[s].classList.contains("advanced")) {{
-                                if (adv_checkbox.checked) {{
-                                    settings[s].style.display = 'table-row';
-                                }} else {{
-                                    settings[s].style.display = 'none';
-                                }}
-                            }} else {{ 
-                                settings[s].style.display = 'table-row';
-                            }}
-                        }} else {{
-                            settings[s].style.display = 'none';
-                        }}
-                    }}
-                }}
-
-                categories[n].addEventListener('click', settings_toggler);
-                window.l.togglers[categories[n].title] = settings_toggler;
-            }}
-
-            let advanced_toggler = function() {{
-                var adv_checkbox = document.getElementById("advanced");
-                let settings = document.getElementsByClassName("advanced");
-                for (let s = 0; s < settings.length; s++) {{
-                    s_cls = settings[s].classList[0];
-                    if (window.l.categories[s_cls] == false) {{
-                        continue;
-                    }}
-                    if (adv_checkbox.checked) {{
-                        settings[s].style.display = 'table-row';
-                    }} else {{
-                        settings[s].style.display = 'none';
-                    }}
-                }}
-            }}
-            adv_checkbox.addEventListener('change', advanced_toggler);
-            if ("{self.hawks.settings.advanced}" == "False") {{
-                advanced_toggler();
-            }}
-        }}
-
-        var one_mode_only = function(mode) {{
-            if ("{self.hawks.settings.no_webui_one_mode_only}" == "True") {{
-                return;
-            }}
-            var categories = document.getElementsByClassName("category");
-            for (let c = 0; c < categories.length; c++) {{
-                if (categories[c].title == "matrix") {{
-                    continue;
-                }}
-                if (categories[c].title == mode) {{
-                    if (window.l.categories[categories[c].title] == false) {{
-                        window.l.togglers[categories[c].title]();
-                    }}
-                    continue;
-                }}
-                if (window.l.categories[categories[c].title] == true) {{
-                    window.l.togglers[categories[c].title]();
-                }}
-            }}
-        }}
-
-        var add_hiders = function(value) {{
-            window.l = {{ categories: {{ }}, togglers: {{ }} }};
-            add_category_hiders();
-            one_mode_only("{self.hawks.settings.mode}");
-        }}
-
-        window.onload = add_hiders;
-        
-        '''
-
-        try:
-            self.hawks.settings.choices["filename"] = [
-                #os.path.join(filepath, item) for item in os.listdir(filepath)
-                item for item in os.listdir(filepath)
-            ]
-        except FileNotFoundError:
+        index_version = None
+        if os.path.isdir(filepath):
+            index = assetindex.get_index(filepath)
+            index.refresh()
+            index_version = index.version
+        return (self.hawks.settings.version, filepath, index_version)
+
+    def make_page(self, text):
+        """
+        Return (etag, body, gzipped body) for text.
+        """
+        body = text.encode("utf-8")
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+        return etag, body, gzip.compress(body)
+
+    def send_page(self, req, page, content_type="text/html; charset=utf-8", cache_control="no-cache"):
+        etag, body, gzipped = page
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if req.headers.get("If-None-Match") == etag:
+            return req.send(304, headers=headers)
+        if "gzip" in req.headers.get("Accept-Encoding", ""):
+            body = gzipped
+            headers["Content-Encoding"] = "gzip"
+        return req.send(200, body=body, content_type=content_type, headers=headers)
+
+    def render(self, message=None):
+        filepath = self.hawks.settings.filepath or "img"
+        if os.path.isdir(filepath):
+            self.hawks.settings.choices["filename"] = list(assetindex.get_index(filepath).paths())
+        else:
             self.hawks.settings.choices["filename"] = None
 
         #self.hawks.settings.set("urls", self.hawks.settings.url, choices=read_urls(self.hawks), show=False)
 
+        hawks_ui = json.dumps({
+            "advanced": bool(self.hawks.settings.advanced),
+            "no_webui_one_mode_only": bool(self.hawks.settings.no_webui_one_mode_only),
+            "mode": self.hawks.settings.mode,
+        })
+        js_version = self.js[0].strip('"')
         body = []
-        body.append(f"<html><head><title>Hawks UI</title><script>{api_js}</script></head><body><H1>Hawks UI</H1>")
+        body.append(f'<html><head><title>Hawks UI</title><script>var hawks_ui = {hawks_ui};</script><script src="/webui.js?v={js_version}"></script></head><body><H1>Hawks UI</H1>')
         if message:
             body.append(f"<h3>{time.asctime()}: {message}</h3>")
         body.append('<form method="post" action="/"><table>')
-        body.append(f'<tr><td><input label="Advanced" type="checkbox" name="advanced" id="advanced" {"checked" if self.hawks.settings.get("advanced") else ""} />Advanced</td><td></td><td rowspan=4><img height="64" src="/api/do/image"></img></td></tr>')
+        body.append(f'<tr><td><input label="Advanced" type="checkbox" name="advanced" id="advanced" {"checked" if self.hawks.settings.get("advanced") else ""} />Advanced</td><td></td><td rowspan=4><img height="64" src="/api/do/stream" onerror="this.onerror=null; this.src=\'/api/do/image\'"></img></td></tr>')
         categories = self.hawks.settings.list_categories()
         for category in categories:
             body.append(f"<tr class=\"category\" title=\"{category}\"><td><strong>{category} settings</strong></td></tr>")
@@ -152,7 +115,6 @@ class Webui(object):
                 if setting in self.hawks.settings.choices and self.hawks.settings.choices[setting]:
                     choices = self.hawks.settings.choices[setting]
                     if setting == "filename":
-                        choices.sort()
                         body.append(f'<select name={setting} value={value} size=12 oninput="update_preview(this.value)">')
                         for choice in choices:
                             if choice == value:
@@ -162,12 +124,12 @@ class Webui(object):
                         body.append("</select></td><td rowspan=1><img style=\"max-height: 200px;\" id=\"preview\"</img>")
                     elif setting == "mode":
                         body.append(f'<select name={setting} value={value} oninput="one_mode_only(this.value)">')
-                        choices.sort(key=lambda x: x != value)
+                        choices = sorted(choices, key=lambda x: x != value)
                         for choice in choices:
                             body.append(f'<option value="{choice}">{choice}</option>')
                         body.append("</select>")
                     elif setting == "urls":
-                        choices.sort()
+                        choices = sorted(choices)
                         body.append(f'<select name={setting} value={value} size=12 oninput="update_url(this.value)">')
                         for choice in choices:
                             if choice == value:
@@ -177,7 +139,7 @@ class Webui(object):
                         body.append("</select></td><td rowspan=1>")
                     else:
                         body.append(f"<select name={setting} value={value}>")
-                        choices.sort(key=lambda x: x != value)
+                        choices = sorted(choices, key=lambda x: x != value)
                         for choice in choices:
                             body.append(f'<option value="{choice}">{choice}</option>')
                         body.append("</select>")
@@ -190,7 +152,7 @@ class Webui(object):
                 body.append("</tr>")
         body.append("</table><br><input type=submit>")
         body.append("</form></body></html>")
-        req.send(200, body="".join(body))
+        return "".join(body)
 
     def webui_submit(self, req):
         req.parts = ["api", "set"]